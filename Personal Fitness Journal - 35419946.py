@@ -1,15 +1,209 @@
+import os
+import re
+import sys
+import shlex
+import sqlite3
+import glob
+import heapq
+import json
+import time
+import atexit
+import contextlib
+import cProfile
+import functools
+import threading
+import argparse
+import numpy as np
 import pandas as pd
-from datetime import datetime
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
 
-#File location
-data_file = "fitness_journal.csv"
+#Storage formats by file extension; parquet and feather need pyarrow, sqlite is built in
+storage_formats = {".csv": "csv", ".parquet": "parquet", ".feather": "feather", ".sqlite": "sqlite", ".db": "sqlite"}
+#File location (FITNESS_JOURNAL_FORMAT=parquet, feather or sqlite switches storage)
+data_file = "fitness_journal." + os.environ.get("FITNESS_JOURNAL_FORMAT", "csv").lower()
+#Write-ahead log of changes not yet folded into data_file
+log_file = data_file + ".log"
+#Per-day, per-week and per-month totals saved alongside data_file
+rollup_file = data_file + ".rollups.json"
+columns = ["Activity", "Type", "Duration", "Distance", "Calorie", "Date", "Notes"]
+#Column holding each activity's permanent ID; in memory the IDs are the DataFrame's labels
+id_column = "ID"
+#Compact in-memory types; Date is datetime64 and Notes stays as text
+column_types = {"Activity": "category", "Type": "category", "Duration": "int32", "Distance": "float32", "Calorie": "float32"}
+#Longest duration in minutes the Duration column can hold; larger values are rejected, never wrapped
+max_duration = int(np.iinfo(np.int32).max)
+#Dates are typed in memory and written in this format
+date_format = "%d/%m/%Y"
+#Columns covered by the keyword search index
+search_columns = ["Activity", "Type", "Notes", "Date"]
+#Columns a summary needs, so columnar files can skip the rest
+summary_columns = ["Date", "Distance", "Calorie", "Duration"]
 
-#Initialize a DataFrame for data storage
-try:
-    activities = pd.read_csv(data_file)
-except FileNotFoundError:
-    print(f"{data_file} not found. Starting with an empty journal.")
-    activities = pd.DataFrame(columns=["Activity", "Type", "Duration", "Distance", "Calorie", "Date", "Notes"])
+#Number of logged operations before the log is folded into data_file
+compact_threshold = 500
+#Logged operations that only add rows
+add_ops = ("add", "import")
+#Logged operations that change or delete a list of rows by ID
+bulk_ops = ("bulk_edit", "bulk_delete")
+#Commands a batch file may contain
+batch_commands = ("add", "edit", "delete", "bulk-edit", "bulk-delete", "search", "summary", "records", "trend", "import")
+#Rows read at a time by streaming summaries
+chunk_size = 100_000
+#Activities shown per page by details(), edit() and delete(); the browse prompt can change it (s <rows>)
+page_size = 20
+#Smallest and largest page size the browse prompt accepts
+page_size_limits = (1, 500)
+#Seconds the background saver waits for more changes before writing, and the longest it lets them queue
+save_delay = 0.5
+save_max_delay = 5
+
+#DataFrame for data storage (filled by load_data), kept sorted by Date
+activities = pd.DataFrame(columns=columns)
+#ID for the next row; an ID stays with its row until the row is deleted and is never handed out again,
+#so the next ID is saved in data_file + ".next_id" (or in the SQLite journal) rather than worked out from the rows
+next_label = 1
+#IDs of deleted rows that are still in activities; they are dropped together once there are
+#tombstone_threshold of them, or when the journal is saved
+tombstones = set()
+tombstone_threshold = 1000
+#Whether data_file already stores IDs (journals from before IDs were added get them on the next full save)
+ids_stored = True
+#First label not yet in data_file, operations waiting in the log, and whether they are all adds
+base_label = 0
+pending_ops = 0
+log_adds_only = True
+#Log lines applied in memory but not yet written; the saver thread writes them together
+unsaved_lines = []
+#Signature of data_file when this session last loaded or saved it, and every log line this session has applied
+#since then; if another session saves the journal in between, these lines are redone on top of its copy
+journal_base = None
+session_lines = []
+#data_file + ".lock" is held while IDs are handed out and while the log or data_file is written, so sessions
+#sharing a journal take turns; a lock older than lock_timeout seconds was left by a crashed session
+lock_guard = threading.RLock()
+lock_depth = 0
+lock_timeout = 10
+#Held while the journal changes or is written, so the saver never sees half an operation
+journal_lock = threading.RLock()
+save_wakeup = threading.Event()
+saver = None
+#Whether record() writes each operation to the log; batch mode saves once at the end instead
+write_ahead = True
+#Open connection when data_file is a SQLite database
+connection = None
+#Whether the in-memory keyword index and rollups are kept (SQLite answers those queries itself)
+memory_indexes = True
+#Summary totals per calendar period: "day" (2024-11-15), "week" (2024-W46) and "month" (2024-11)
+rollups = {"day": {}, "week": {}, "month": {}}
+#Period keys changed since the rollups were last saved; a compaction appends just these to rollup_file + ".delta",
+#and the deltas are folded into rollup_file once there are rollup_fold_threshold of them
+changed_periods = {"day": set(), "week": set(), "month": set()}
+rollup_deltas = 0
+rollup_fold_threshold = 50
+#Keyword index: token -> labels of the rows containing it.
+#Built on the first search, so commands that never search do not pay for it
+search_index = defaultdict(set)
+search_index_built = False
+#Personal records kept per activity and metric: metric -> activity -> min-heap of (score, ID) holding
+#the record_size best rows (higher score is better). Built on first use, then kept up to date by every change
+record_size = 3
+personal_records = {"distance": {}, "pace": {}, "calories": {}}
+records_built = False
+#Activities whose heaps lost a record-holding row; they are rebuilt before the records are next read
+stale_records = set()
+#Windows of the rolling averages, in days
+rolling_windows = (7, 28)
+#Bumped by every change to the journal; cached breakdowns are only reused for the version they were made from
+journal_version = 0
+#Breakdowns already computed: (column, start date, end date, journal_version) -> DataFrame
+breakdown_cache = {}
+#Columns a summary can be broken down by
+breakdown_columns = {"activity": "Activity", "type": "Type"}
+#Bin sizes of a trend report: pandas frequency (weeks start on Monday) and how a bin is labelled
+trend_bins = {"day": ("D", date_format), "week": ("W-MON", date_format), "month": ("MS", "%m/%Y")}
+#Fields a structured query can name (activity:cycling distance>10), and the column each one filters
+query_fields = {"activity": "Activity", "type": "Type", "duration": "Duration", "distance": "Distance",
+                "calorie": "Calorie", "calories": "Calorie", "date": "Date", "notes": "Notes", "note": "Notes"}
+query_term = re.compile(r"(\w+)(>=|<=|:|=|>|<)(.*)", re.S)
+#Trigram index over the indexed words, for typo-tolerant search: trigram -> words containing it
+trigram_index = defaultdict(set)
+#Lowest similarity (shared trigrams over all trigrams) a fuzzy match may have
+fuzzy_threshold = 0.4
+
+#Opt-in instrumentation: FITNESS_JOURNAL_PROFILE names a JSON lines file for timings,
+#FITNESS_JOURNAL_PROFILE_DIR a folder for cProfile dumps of the slowest calls
+profile_log = os.environ.get("FITNESS_JOURNAL_PROFILE")
+profile_dir = os.environ.get("FITNESS_JOURNAL_PROFILE_DIR")
+#cProfile dumps kept per operation
+profile_keep = 5
+#Slowest profiled calls so far: operation -> [(wall seconds, dump path)]
+slowest_profiles = defaultdict(list)
+#Running count of rows read or changed and bytes written, for the instrumentation
+io_stats = {"rows": 0, "bytes": 0}
+#Held while a call is being profiled; only one profiler can run at a time, so nested calls
+#(compact_data -> save_data) and calls from the saver thread are timed but not profiled
+profile_lock = threading.Lock()
+
+#Count rows touched and bytes written
+def count_io(rows=0, written=0):
+    io_stats["rows"] += rows
+    io_stats["bytes"] += written
+
+#Keep a cProfile dump if the call is among the slowest profile_keep for its operation
+def keep_profile(name, elapsed, profiler):
+    kept = slowest_profiles[name]
+    if len(kept) >= profile_keep and elapsed <= kept[0][0]:
+        return None
+    os.makedirs(profile_dir, exist_ok=True)
+    path = os.path.join(profile_dir, f"{name}-{time.time_ns()}.prof")
+    profiler.dump_stats(path)
+    kept.append((elapsed, path))
+    kept.sort()
+    if len(kept) > profile_keep:
+        _, dropped = kept.pop(0)
+        if os.path.exists(dropped):
+            os.remove(dropped)
+    return path
+
+#Time a function and log wall time, rows touched and bytes written when profiling is on
+def instrumented(name):
+    def decorate(fn):
+        @functools.wraps(fn)
+        def timed(*args, **kwargs):
+            if not profile_log:
+                return fn(*args, **kwargs)
+            rows, written = io_stats["rows"], io_stats["bytes"]
+            profiler = cProfile.Profile() if profile_dir and profile_lock.acquire(blocking=False) else None
+            error = None
+            started = time.perf_counter()
+            try:
+                if profiler:
+                    return profiler.runcall(fn, *args, **kwargs)
+                return fn(*args, **kwargs)
+            except BaseException as e:
+                error = repr(e)
+                raise
+            finally:
+                elapsed = time.perf_counter() - started
+                entry = {
+                    "time": datetime.now().isoformat(timespec="milliseconds"),
+                    "operation": name,
+                    "wall_ms": round(elapsed * 1000, 3),
+                    "rows_touched": io_stats["rows"] - rows,
+                    "bytes_written": io_stats["bytes"] - written,
+                    "journal_rows": activity_count(),
+                }
+                if error:
+                    entry["error"] = error
+                if profiler:
+                    profile_lock.release()
+                    entry["profile"] = keep_profile(name, elapsed, profiler)
+                with open(profile_log, "a") as f:
+                    f.write(json.dumps(entry) + "\n")
+        return timed
+    return decorate
 
 # Function for input validation
 def getInput(prompt, error_message, parser, validator=None):
@@ -65,7 +259,7 @@ def main():
         elif choice == 6:
             display_summary()
         elif choice == 7:
-           save_data()
+           compact_data()
            print("Data has been saved. Would you like to exit or return to the main menu?")
            exit_choice = input("Type 'exit' to quit or 'menu' to return to the main menu: ").strip().lower()
            if exit_choice == 'exit':
@@ -78,11 +272,1314 @@ def main():
         else:
             print("Invalid choice. Please enter a number between 1 to 7.")
 
-#Save data to the CSV file
+#Storage format of a journal file, from its extension
+def journal_format(path):
+    return storage_formats.get(os.path.splitext(path)[1].lower(), "csv")
+
+#Label rows by their stored ID; journals written before IDs existed are numbered 1, 2, ... in file order
+def label_rows(journal):
+    if id_column in journal:
+        return journal.set_index(id_column).rename_axis(None)
+    journal.index = range(1, len(journal) + 1)
+    return journal
+
+#Read a journal file, optionally only some of its columns, with Date typed
+def read_journal(path, usecols=None, file_format=None):
+    file_format = file_format or journal_format(path)
+    if file_format == "sqlite":
+        return read_sqlite(path, usecols)
+    if file_format == "parquet":
+        return pd.read_parquet(path, columns=usecols)
+    if file_format == "feather":
+        return pd.read_feather(path, columns=usecols)
+    journal = pd.read_csv(path, usecols=usecols)
+    if 'Date' in journal:
+        journal['Date'] = pd.to_datetime(journal['Date'], format=date_format, errors="coerce")
+    return journal
+
+#Write a whole journal file in the given format, IDs first
+def write_journal(journal, path, file_format=None, next_id=None):
+    file_format = file_format or journal_format(path)
+    journal = journal[columns].rename_axis(id_column).reset_index()
+    if file_format == "sqlite":
+        write_sqlite(journal, path, next_id)
+    elif file_format == "parquet":
+        journal.to_parquet(path, index=False)
+    elif file_format == "feather":
+        journal.to_feather(path)
+    else:
+        journal.to_csv(path, index=False, date_format=date_format)
+
+#Table and indexes of a SQLite journal; dates are stored as YYYY-MM-DD so they sort as text
+#ID is the rowid (tables created before it existed use their plain rowid, which is queried the same way)
+sqlite_schema = """
+CREATE TABLE IF NOT EXISTS activities (
+    ID INTEGER PRIMARY KEY,
+    Activity TEXT NOT NULL,
+    Type TEXT NOT NULL,
+    Duration INTEGER NOT NULL,
+    Distance REAL,
+    Calorie REAL NOT NULL,
+    Date TEXT NOT NULL,
+    Notes TEXT
+);
+CREATE INDEX IF NOT EXISTS activities_date ON activities (Date);
+CREATE INDEX IF NOT EXISTS activities_activity ON activities (Activity COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS activities_type ON activities (Type COLLATE NOCASE);
+CREATE TABLE IF NOT EXISTS journal_meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL);
+"""
+
+#Open a SQLite journal, creating the table and indexes if needed
+def open_sqlite(path):
+    db = sqlite3.connect(path)
+    db.executescript(sqlite_schema)
+    #Whole-word matches on Notes, the same rule the in-memory notes: search uses
+    db.create_function("REGEXP", 2, lambda pattern, text: text is not None and re.search(pattern, text) is not None,
+                       deterministic=True)
+    return db
+
+#Connection to data_file when it is a SQLite journal
+def sqlite_connection():
+    global connection
+    if connection is None:
+        connection = open_sqlite(data_file)
+    return connection
+
+#Next ID saved in a SQLite journal (1 if it has none yet)
+def sqlite_next_id(db):
+    saved = db.execute("SELECT value FROM journal_meta WHERE name = 'next_id'").fetchone()
+    return saved[0] if saved else 1
+
+#Save the next ID in a SQLite journal; it only ever goes up
+def set_sqlite_next_id(db, next_id):
+    db.execute("INSERT INTO journal_meta (name, value) VALUES ('next_id', ?) "
+               "ON CONFLICT (name) DO UPDATE SET value = MAX(value, excluded.value)", (int(next_id),))
+
+#Read a SQLite journal in date order, with its rowids as the ID column
+def read_sqlite(path, usecols=None):
+    if not os.path.exists(path):
+        raise FileNotFoundError(path)
+    db = open_sqlite(path)
+    try:
+        selected = ", ".join(usecols or columns)
+        journal = pd.read_sql_query(f"SELECT rowid AS {id_column}, {selected} FROM activities ORDER BY Date, rowid", db)
+    finally:
+        db.close()
+    if 'Date' in journal:
+        journal['Date'] = pd.to_datetime(journal['Date'], format="%Y-%m-%d", errors="coerce")
+    return journal
+
+#Rows of a journal as SQLite parameters
+def sqlite_rows(journal):
+    journal = journal[columns].astype(object)
+    journal['Date'] = pd.to_datetime(journal['Date']).dt.strftime("%Y-%m-%d")
+    return journal.where(journal.notna(), None).itertuples(index=False, name=None)
+
+#Replace the contents of a SQLite journal in one transaction, keeping each row's ID as its rowid
+def write_sqlite(journal, path, next_id=None):
+    db = open_sqlite(path)
+    try:
+        with db:
+            db.execute("DELETE FROM activities")
+            db.executemany("INSERT INTO activities (rowid, Activity, Type, Duration, Distance, Calorie, Date, Notes) "
+                           "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                           ((int(label), *values) for label, values in zip(journal[id_column], sqlite_rows(journal))))
+            set_sqlite_next_id(db, max(next_id or 1, int(journal[id_column].max()) + 1 if len(journal) else 1))
+    finally:
+        db.close()
+
+#Apply an operation to the SQLite journal; committed at once unless batch mode defers it
+def sqlite_apply(op):
+    db = sqlite_connection()
+    if op["op"] in add_ops:
+        rows = pd.DataFrame([op["row"]] if op["op"] == "add" else op["rows"], columns=columns)
+        rows['Date'] = pd.to_datetime(rows['Date'], format=date_format)
+        #Another session may have added rows since this one loaded, so start from the saved next ID too;
+        #apply_operation gives the rows the same IDs
+        op["id"] = max(next_label, sqlite_next_id(db))
+        labels = range(op["id"], op["id"] + len(rows))
+        db.executemany("INSERT INTO activities (rowid, Activity, Type, Duration, Distance, Calorie, Date, Notes) "
+                       "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                       ((label, *values) for label, values in zip(labels, sqlite_rows(rows))))
+        set_sqlite_next_id(db, labels.stop)
+    else:
+        labels = [int(label) for label in op["ids"]] if op["op"] in bulk_ops else [int(op_label(op))]
+        if op["op"] in ("delete", "bulk_delete"):
+            db.executemany("DELETE FROM activities WHERE rowid = ?", ((label,) for label in labels))
+        else:
+            changes = dict(op["changes"])
+            if 'Date' in changes:
+                changes['Date'] = datetime.strptime(changes['Date'], date_format).strftime("%Y-%m-%d")
+            assignments = ", ".join(f"{column} = ?" for column in changes)
+            db.executemany(f"UPDATE activities SET {assignments} WHERE rowid = ?",
+                           ((*changes.values(), label) for label in labels))
+    if write_ahead:
+        db.commit()
+
+#Summary totals between two dates, computed by SQLite using the Date index
+def sqlite_totals(start_date, end_date, db=None):
+    db = db or sqlite_connection()
+    count, distance, calories, duration, duration_count = db.execute(
+        "SELECT COUNT(*), TOTAL(Distance), TOTAL(Calorie), TOTAL(Duration), COUNT(Duration) "
+        "FROM activities WHERE Date BETWEEN ? AND ?",
+        (start_date.strftime("%Y-%m-%d"), end_date.strftime("%Y-%m-%d"))).fetchone()
+    return {"count": count, "distance": distance, "calories": calories, "duration": duration, "duration_count": duration_count}
+
+#LIKE pattern matching text anywhere, with LIKE's wildcards escaped
+def like_pattern(text):
+    return "%" + text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+#A DD/MM/YYYY date as stored in SQLite (YYYY-MM-DD), or None if text is not one
+def sqlite_date(text):
+    try:
+        return datetime.strptime(text, date_format).strftime("%Y-%m-%d")
+    except ValueError:
+        return None
+
+#Rows of activities with the given rowids, in date order
+def rows_with_ids(rowids):
+    positions = sorted(activities.index.get_indexer([rowid for (rowid,) in rowids]))
+    return activities.iloc[[position for position in positions if position >= 0]]
+
+#Search a SQLite journal: indexed lookups on Activity, Type and Date first, then a LIKE scan for partial words
+def sqlite_search(query):
+    db = sqlite_connection()
+    rowids = db.execute(
+        "SELECT rowid FROM activities WHERE Activity = ? COLLATE NOCASE "
+        "UNION SELECT rowid FROM activities WHERE Type = ? COLLATE NOCASE "
+        "UNION SELECT rowid FROM activities WHERE Date = ?", (query, query, sqlite_date(query))).fetchall()
+    if not rowids:
+        rowids = db.execute(
+            "SELECT rowid FROM activities WHERE Activity LIKE ?1 ESCAPE '\\' OR Type LIKE ?1 ESCAPE '\\' "
+            "OR Notes LIKE ?1 ESCAPE '\\'", (like_pattern(query),)).fetchall()
+    return rows_with_ids(rowids)
+
+#Compile query terms (and an optional date range) into a WHERE clause and its parameters, so SQLite
+#filters with its Date, Activity and Type indexes instead of the in-memory copy
+def sqlite_where(terms=(), start_date=None, end_date=None):
+    clauses = []
+    params = []
+    ranges = [(start_date, end_date)]
+    for column, operator, value in terms:
+        if column is None:
+            clauses.append("(Activity LIKE ? ESCAPE '\\' OR Type LIKE ? ESCAPE '\\' OR Notes LIKE ? ESCAPE '\\' OR Date = ?)")
+            pattern = like_pattern(value)
+            params += [pattern, pattern, pattern, sqlite_date(value)]
+        elif column == 'Date':
+            ranges.append(date_bounds(operator, value))
+        elif column in ('Activity', 'Type'):
+            if operator not in (":", "="):
+                raise ValueError(f"{column.lower()} can only be matched with ':'")
+            clauses.append(f"{column} = ? COLLATE NOCASE")
+            params.append(value)
+        elif column == 'Notes':
+            tokens = tokenize(value)
+            if not tokens:
+                raise ValueError(f"notes:{value} has no words to look for")
+            for token in tokens:
+                clauses.append("Notes REGEXP ?")
+                params.append(rf"(?i)\b{re.escape(token)}\b")
+        else:
+            try:
+                if ".." in value and operator in (":", "="):
+                    low, high = value.split("..", 1)
+                    bounds = [(">=", low), ("<=", high)]
+                else:
+                    bounds = [({":": "=", "=": "="}.get(operator, operator), value)]
+                bounds = [(comparison, float(number)) for comparison, number in bounds if number]
+            except ValueError:
+                raise ValueError(f"{column.lower()}{operator}{value} needs a number") from None
+            for comparison, number in bounds:
+                clauses.append(f"{column} {comparison} ?")
+                params.append(number)
+    for start, end in ranges:
+        if start is not None:
+            clauses.append("Date >= ?")
+            params.append(start.strftime("%Y-%m-%d"))
+        if end is not None:
+            clauses.append("Date <= ?")
+            params.append(end.strftime("%Y-%m-%d"))
+    return " AND ".join(clauses) or "1", params
+
+#Rowids of a SQLite journal's activities matching query terms, in date order
+def sqlite_matches(terms=(), start_date=None, end_date=None):
+    where, params = sqlite_where(terms, start_date, end_date)
+    return sqlite_connection().execute(f"SELECT rowid FROM activities WHERE {where} ORDER BY Date, rowid", params).fetchall()
+
+#Totals per Activity or Type between two dates, grouped by SQLite
+def sqlite_breakdown(column, start_date, end_date):
+    where, params = sqlite_where(start_date=start_date, end_date=end_date)
+    grouped = pd.read_sql_query(
+        f"SELECT {column}, COUNT(*) AS Activities, TOTAL(Distance) AS Distance, TOTAL(Calorie) AS Calories, "
+        f"TOTAL(Duration) AS Duration, AVG(Duration) AS Average_Duration FROM activities WHERE {where} GROUP BY {column}",
+        sqlite_connection(), params=params)
+    return grouped.set_index(column).astype({"Duration": "int64"})
+
+#SQLite expression giving the first day of a row's trend bin (weeks start on Monday)
+sqlite_bins = {
+    "day": "Date",
+    "week": "date(Date, '-' || ((CAST(strftime('%w', Date) AS INTEGER) + 6) % 7) || ' days')",
+    "month": "substr(Date, 1, 7) || '-01'",
+}
+
+#Totals per trend bin between two dates, grouped by SQLite
+def sqlite_trend(start_date, end_date, every):
+    where, params = sqlite_where(start_date=start_date, end_date=end_date)
+    grouped = pd.read_sql_query(
+        f"SELECT {sqlite_bins[every]} AS Bin, COUNT(*) AS Activities, TOTAL(Distance) AS Distance, "
+        f"TOTAL(Calorie) AS Calories, SUM(Duration) AS Duration FROM activities WHERE {where} GROUP BY Bin",
+        sqlite_connection(), params=params)
+    grouped.index = pd.to_datetime(grouped.pop('Bin'), format="%Y-%m-%d")
+    return grouped
+
+#Convert a journal file to another storage format (e.g. fitness_journal.csv -> fitness_journal.parquet)
+def convert_journal(source, destination):
+    if os.path.exists(source + ".log"):
+        print(f"Warning: {source}.log has unsaved changes that are not converted. Open the journal once to fold them in.")
+    journal = label_rows(read_journal(source)).sort_values('Date', kind="stable")
+    next_id = stored_next_id(source)
+    write_journal(journal, destination, next_id=next_id)
+    if journal_format(destination) != "sqlite":
+        #The destination's rollups are rebuilt when it is first opened; only its next ID is carried over
+        with open(destination + ".rollups.json", "w") as f:
+            json.dump({"base": None, "next_id": next_id}, f)
+    print(f"Converted {len(journal)} activities from {source} to {destination}.")
+
+#Next ID saved for a journal file, from its .next_id file and rollups or its SQLite table (1 if there is none)
+def stored_next_id(path):
+    if journal_format(path) == "sqlite":
+        db = open_sqlite(path)
+        try:
+            return sqlite_next_id(db)
+        finally:
+            db.close()
+    try:
+        with open(path + ".rollups.json") as f:
+            rollup_next_id = json.load(f).get("next_id", 1)
+    except (OSError, ValueError):
+        rollup_next_id = 1
+    return max(rollup_next_id, saved_next_id(path))
+
+#Save data to the journal file (full rewrite, only used when compacting)
+@instrumented("save_data")
 def save_data():
     global activities
-    activities.to_csv(data_file, index=False)
+    purge_tombstones()
+    #Write to a temporary file first so a crash never leaves half a journal
+    temp_file = data_file + ".tmp"
+    write_journal(activities, temp_file, journal_format(data_file))
+    os.replace(temp_file, data_file)
+    count_io(rows=len(activities), written=os.path.getsize(data_file))
+
+#Append new rows to the end of the CSV file without rewriting it (CSV with stored IDs only)
+def append_data(new_rows):
+    write_header = not os.path.exists(data_file) or os.path.getsize(data_file) == 0
+    size_before = 0 if write_header else os.path.getsize(data_file)
+    if not write_header:
+        #Make sure the new rows start on their own line
+        with open(data_file, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) not in (b"\n", b"\r"):
+                with open(data_file, "a", newline="") as out:
+                    out.write("\n")
+    new_rows[columns].to_csv(data_file, mode="a", header=write_header, index_label=id_column, date_format=date_format)
+    count_io(rows=len(new_rows), written=os.path.getsize(data_file) - size_before)
+
+#Size and modification time of data_file, used to tie the log to the file it was written against
+def base_signature():
+    try:
+        stat = os.stat(data_file)
+    except FileNotFoundError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+#Hold the journal's lock file; nested uses in this process share one lock
+@contextlib.contextmanager
+def file_lock():
+    global lock_depth
+    path = data_file + ".lock"
+    with lock_guard:
+        while lock_depth == 0:
+            try:
+                os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                break
+            except FileExistsError:
+                try:
+                    if time.time() - os.path.getmtime(path) > lock_timeout:
+                        os.remove(path)
+                        continue
+                except FileNotFoundError:
+                    continue
+                time.sleep(0.01)
+        lock_depth += 1
+        try:
+            yield
+        finally:
+            lock_depth -= 1
+            if lock_depth == 0:
+                os.remove(path)
+
+#Next ID saved in data_file + ".next_id" (1 if there is none)
+def saved_next_id(path):
+    try:
+        with open(path + ".next_id") as f:
+            return int(f.read())
+    except (OSError, ValueError):
+        return 1
+
+#Hand out count new IDs; the saved next ID is re-read under the lock, so two sessions never get the same ones
+def allocate_ids(count):
+    with file_lock():
+        start = max(next_label, saved_next_id(data_file))
+        temp_file = data_file + ".next_id.tmp"
+        with open(temp_file, "w") as f:
+            f.write(str(start + count))
+        os.replace(temp_file, data_file + ".next_id")
+    return start
+
+#Load data_file and replay any operations left in the log
+#read_only replays the log in memory only: no rollups are built or saved and no file is removed or rewritten
+@instrumented("load_data")
+def load_data(read_only=False):
+    global activities, base_label, pending_ops, log_adds_only, next_label, memory_indexes, ids_stored, journal_base
+    journal_base = base_signature()
+    session_lines.clear()
+    try:
+        #Dates are parsed once here, vectorized
+        activities = read_journal(data_file)
+    except FileNotFoundError:
+        print(f"{data_file} not found. Starting with an empty journal.")
+        activities = pd.DataFrame(columns=[id_column] + columns)
+        activities['Date'] = pd.to_datetime(activities['Date'])
+    ids_stored = id_column in activities or activities.empty
+    tombstones.clear()
+    reset_records()
+    breakdown_cache.clear()
+    #Rows are labelled by their ID, so edits and deletes find them with a hash lookup
+    activities = label_rows(activities).astype(column_types)
+    if activities.index.has_duplicates:
+        duplicates = activities.index[activities.index.duplicated()].unique()
+        raise ValueError(f"{data_file} has more than one activity with ID " + ", ".join(map(str, duplicates[:10])))
+    #Stable sort so rows on the same date keep their order in the file; the copy owns its buffers,
+    #which pyarrow hands back read-only for Parquet/Feather (astype keeps them when a column is already a category)
+    activities = activities.sort_values('Date', kind="stable").copy()
+    count_io(rows=len(activities))
+    next_label = int(activities.index.max()) + 1 if len(activities) else 1
+    pending_ops = 0
+    log_adds_only = True
+    if journal_format(data_file) == "sqlite":
+        #Every change is its own transaction, so there is no log to replay
+        memory_indexes = False
+        next_label = max(next_label, sqlite_next_id(sqlite_connection()))
+        base_label = next_label
+        return
+    memory_indexes = not read_only
+    reset_search_index()
+    if not read_only:
+        #Also raises next_label to the saved next ID, past any deleted rows
+        load_rollups()
+    next_label = max(next_label, saved_next_id(data_file))
+    base_label = next_label
+
+    if not os.path.exists(log_file):
+        return
+    with open(log_file) as f:
+        lines = f.read().splitlines()
+    try:
+        header = json.loads(lines[0])
+    except (IndexError, ValueError):
+        header = None
+    #A log whose header does not match data_file has already been folded into it
+    if header is None or header.get("base") != base_signature():
+        if not read_only:
+            os.remove(log_file)
+        return
+    #Adds in the log take their IDs from where they did when it was written
+    next_label = base_label = max(next_label, header.get("next_id", 1))
+    replayed = []
+    rejected = []
+    for line in lines[1:]:
+        try:
+            op = json.loads(line)
+        except ValueError:
+            #A torn last line from a crash mid-write; everything before it is intact
+            break
+        try:
+            apply_operation(op)
+        except Exception as e:
+            #An operation that cannot be applied is set aside so the journal still opens
+            rejected.append(line)
+            if not read_only:
+                print(f"Skipped a change from {log_file} that could not be applied ({e}).")
+            continue
+        replayed.append(line)
+        session_lines.append(line + "\n")
+        pending_ops += 1
+        log_adds_only = log_adds_only and op["op"] in add_ops
+    if read_only:
+        return
+    if rejected:
+        quarantine_log(lines[0], replayed, rejected)
+    if pending_ops:
+        print(f"Recovered {pending_ops} unsaved change(s) from {log_file}.")
+
+#Move log lines that failed to replay to log_file + ".rejected" and rewrite the log without them
+def quarantine_log(header, replayed, rejected):
+    with open(log_file + ".rejected", "a") as f:
+        f.write("".join(line + "\n" for line in rejected))
+    temp_file = log_file + ".tmp"
+    with open(temp_file, "w") as f:
+        f.write("".join(line + "\n" for line in [header] + replayed))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_file, log_file)
+    print(f"{len(rejected)} change(s) that could not be applied were moved to {log_file}.rejected.")
+
+#Insert a one-row DataFrame after any rows on the same date, keeping the journal sorted
+def insert_row(row):
+    global activities
+    position = activities['Date'].searchsorted(row['Date'].iloc[0], side="right")
+    pieces = [activities.iloc[:position], row, activities.iloc[position:]]
+    activities = pd.concat([piece for piece in pieces if len(piece)])
+
+#Rows dated between start_date and end_date (inclusive), found by binary search
+def rows_between(start_date, end_date):
+    dates = activities['Date']
+    start = dates.searchsorted(start_date, side="left")
+    stop = dates.searchsorted(end_date, side="right")
+    return live_rows(activities.iloc[start:stop])
+
+#Rows that have not been deleted
+def live_rows(rows):
+    if not tombstones:
+        return rows
+    return rows[~rows.index.isin(tombstones)]
+
+#Whether label is the ID of an activity that has not been deleted
+def has_activity(label):
+    return label in activities.index and label not in tombstones
+
+#Number of activities that have not been deleted
+def activity_count():
+    return len(activities) - len(tombstones)
+
+#Drop every tombstoned row in one pass
+def purge_tombstones():
+    global activities
+    if tombstones:
+        activities = activities.drop(list(tombstones))
+        tombstones.clear()
+
+#Split text into lowercase keyword tokens; a date (D/M/YYYY) stays one token, written as DD/MM/YYYY
+def tokenize(text):
+    tokens = []
+    for match in re.finditer(r"(\d{1,2})/(\d{1,2})/(\d{4})|[a-z0-9]+", str(text).lower()):
+        day, month, year = match.groups()
+        tokens.append(f"{int(day):02d}/{int(month):02d}/{year}" if year else match.group())
+    return tokens
+
+#Tokens of one value of a search column
+def value_tokens(column, value):
+    if pd.isna(value):
+        return set()
+    if column == 'Date':
+        value = value.strftime(date_format)
+    return set(tokenize(value))
+
+#Tokens of one row, given its values for the search columns
+def keywords(values):
+    tokens = set()
+    for column, value in zip(search_columns, values):
+        tokens |= value_tokens(column, value)
+    return tokens
+
+#Add rows to the keyword index (nothing to do until it has been built); each distinct value of a
+#column is tokenized once and its rows are added to the postings together
+def index_rows(rows):
+    if not memory_indexes or not search_index_built:
+        return
+    for column in search_columns:
+        values = rows[column]
+        for value, positions in values.groupby(values, observed=True, sort=False).indices.items():
+            labels = rows.index[positions]
+            for token in value_tokens(column, value):
+                if token not in search_index:
+                    index_trigrams(token)
+                search_index[token].update(labels)
+
+#Remove a row from the keyword index; call it while the row still has the values it was indexed with
+def unindex_row(label):
+    if not search_index_built:
+        return
+    for token in keywords(activities.loc[label, search_columns]):
+        search_index[token].discard(label)
+        if not search_index[token]:
+            del search_index[token]
+            unindex_trigrams(token)
+
+#Forget the keyword index; it is built again by the next search
+def reset_search_index():
+    global search_index_built
+    search_index.clear()
+    trigram_index.clear()
+    search_index_built = False
+
+#Build the keyword index for the whole journal if no search has needed it yet
+def ensure_search_index():
+    global search_index_built
+    if memory_indexes and not search_index_built:
+        reset_search_index()
+        search_index_built = True
+        index_rows(live_rows(activities))
+
+#Rows containing every keyword of the query, in date order
+def keyword_search(query):
+    ensure_search_index()
+    tokens = tokenize(query)
+    if not tokens:
+        return activities.iloc[0:0]
+    #Intersect starting from the rarest token so the work follows the number of hits
+    postings = sorted((search_index.get(token, set()) for token in tokens), key=len)
+    hits = set(postings[0])
+    for posting in postings[1:]:
+        hits &= posting
+    positions = sorted(activities.index.get_indexer(list(hits)))
+    return activities.iloc[positions]
+
+#Trigrams of a word, padded so the start and end of the word count too
+def trigrams(word):
+    padded = f"  {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+#Add a new word to the trigram index; numbers (mostly dates) are left out
+def index_trigrams(token):
+    if token.isalpha():
+        for trigram in trigrams(token):
+            trigram_index[trigram].add(token)
+
+#Remove a word that no longer appears in the journal from the trigram index
+def unindex_trigrams(token):
+    if token.isalpha():
+        for trigram in trigrams(token):
+            trigram_index[trigram].discard(token)
+            if not trigram_index[trigram]:
+                del trigram_index[trigram]
+
+#Indexed words similar to word, with their similarity
+def similar_words(word):
+    word_trigrams = trigrams(word)
+    shared = defaultdict(int)
+    for trigram in word_trigrams:
+        for candidate in trigram_index.get(trigram, ()):
+            shared[candidate] += 1
+    matches = {}
+    for candidate, count in shared.items():
+        similarity = count / (len(word_trigrams) + len(trigrams(candidate)) - count)
+        if similarity >= fuzzy_threshold:
+            matches[candidate] = similarity
+    return matches
+
+#Rows matching the query's words despite typos, best matches first, with a Score column
+def fuzzy_search(query):
+    ensure_search_index()
+    words = [token for token in tokenize(query) if token.isalpha()]
+    scores = defaultdict(float)
+    for word in words:
+        #Each row scores the best similarity any of its words has to this query word
+        best = {}
+        for candidate, similarity in similar_words(word).items():
+            for label in search_index[candidate]:
+                if similarity > best.get(label, 0):
+                    best[label] = similarity
+        for label, similarity in best.items():
+            scores[label] += similarity / len(words)
+    if not scores:
+        return activities.iloc[0:0]
+    ranked = sorted(scores.items(), key=lambda item: -item[1])
+    labels = [label for label, _ in ranked]
+    results = activities.loc[labels]
+    return results.assign(Score=[round(score, 2) for _, score in ranked])
+
+#Rows whose text contains the query anywhere (slow fallback for partial words)
+def substring_search(query):
+    matches = pd.Series(False, index=activities.index)
+    for column in columns:
+        values = activities[column]
+        if column == 'Date':
+            values = values.dt.strftime(date_format)
+        matches |= values.astype(str).str.lower().str.contains(query, regex=False)
+    return live_rows(activities[matches])
+
+#Mask of rows dated between start_date and end_date (either may be None), from a binary search of the sorted dates
+def date_mask(start_date=None, end_date=None):
+    dates = activities['Date']
+    start = 0 if start_date is None else dates.searchsorted(start_date, side="left")
+    stop = len(dates) if end_date is None else dates.searchsorted(end_date, side="right")
+    mask = np.zeros(len(dates), dtype=bool)
+    mask[start:stop] = True
+    return pd.Series(mask, index=activities.index)
+
+#Mask of rows whose Activity or Type is value (ignoring case), compared on the category codes
+def category_mask(column, value):
+    categories = activities[column].cat.categories
+    matching = [code for code, name in enumerate(categories) if str(name).lower() == value.lower()]
+    return pd.Series(activities[column].cat.codes.isin(matching), index=activities.index)
+
+#Mask of rows containing keyword, from the keyword index when there is one
+def keyword_mask(keyword):
+    query = keyword.lower()
+    hits = keyword_search(query) if memory_indexes else activities.iloc[0:0]
+    if hits.empty:
+        hits = substring_search(query)
+    return pd.Series(activities.index.isin(hits.index), index=activities.index)
+
+#Mask of rows whose Notes contain every word of text; the keyword index narrows the rows to check
+def notes_mask(text):
+    tokens = tokenize(text)
+    if not tokens:
+        raise ValueError(f"notes:{text} has no words to look for")
+    notes = activities['Notes']
+    if memory_indexes:
+        notes = notes[activities.index.isin(keyword_search(" ".join(tokens)).index)]
+    matches = notes.notna()
+    for token in tokens:
+        matches &= notes.str.contains(rf"\b{token}\b", case=False, regex=True, na=False)
+    return pd.Series(activities.index.isin(notes.index[matches.to_numpy()]), index=activities.index)
+
+#Mask of rows where a number column compares to value (distance>10, duration:30..60)
+def number_mask(column, operator, value):
+    values = activities[column]
+    try:
+        if ".." in value and operator in (":", "="):
+            low, high = value.split("..", 1)
+            mask = pd.Series(True, index=activities.index)
+            if low:
+                mask &= values >= float(low)
+            if high:
+                mask &= values <= float(high)
+            return mask
+        number = float(value)
+    except ValueError:
+        raise ValueError(f"{column.lower()}{operator}{value} needs a number") from None
+    compare = {":": values.eq, "=": values.eq, ">": values.gt, ">=": values.ge, "<": values.lt, "<=": values.le}
+    return compare[operator](number)
+
+#First and last day of a date given as DD/MM/YYYY, or of a period given as YYYY, YYYY-MM or YYYY-MM-DD
+def query_period(text):
+    try:
+        day = pd.Timestamp(datetime.strptime(text, date_format))
+        return day, day
+    except ValueError:
+        pass
+    if not re.fullmatch(r"\d{4}(-\d{2}){0,2}", text):
+        raise ValueError(f"'{text}' is not a date (use DD/MM/YYYY, YYYY, YYYY-MM or YYYY-MM-DD)")
+    period = pd.Period(text)
+    return period.start_time, period.end_time.normalize()
+
+#Start and end dates for a date term (date:2024-11..2024-12, date>=2024-06); None leaves that side open
+def date_bounds(operator, value):
+    if operator in (":", "="):
+        if ".." in value:
+            first, last = value.split("..", 1)
+            return (query_period(first)[0] if first else None, query_period(last)[1] if last else None)
+        return query_period(value)
+    start, end = query_period(value)
+    if operator == ">=":
+        return start, None
+    if operator == ">":
+        return end + pd.Timedelta(days=1), None
+    if operator == "<=":
+        return None, end
+    return None, start - pd.Timedelta(days=1)
+
+#Split a query into (column, operator, value) terms; words without a known field are keywords (column None)
+def parse_query(query):
+    terms = []
+    for token in shlex.split(query):
+        match = query_term.fullmatch(token)
+        if match and match.group(1).lower() in query_fields:
+            field, operator, value = match.groups()
+            if not value:
+                raise ValueError(f"'{token}' has no value")
+            terms.append((query_fields[field.lower()], operator, value))
+        else:
+            terms.append((None, ":", token))
+    return terms
+
+#Whether a search names fields (activity:cycling, distance>10) rather than just keywords
+def is_structured(query):
+    return re.search(r"\b(" + "|".join(query_fields) + r")\s*(>=|<=|:|=|>|<)", query, re.I) is not None
+
+#Join search words given as separate command-line arguments into one query string; each argument is
+#split into terms on its own, except one that is a single field term (notes:hilly route), which keeps its spaces
+def query_from_arguments(words):
+    if not any(is_structured(word) for word in words):
+        return " ".join(words)
+    tokens = []
+    for word in words:
+        match = query_term.fullmatch(word)
+        if match and match.group(1).lower() in query_fields and not is_structured(match.group(3)):
+            tokens.append(word)
+        else:
+            tokens += shlex.split(word)
+    return shlex.join(tokens)
+
+#Compile a structured query into one mask: dates by binary search, activity and type by category code,
+#notes and plain words through the keyword index, numbers by vectorized comparison
+def query_mask(query):
+    mask = pd.Series(True, index=activities.index)
+    for column, operator, value in parse_query(query):
+        if column is None:
+            mask &= keyword_mask(value)
+        elif column == 'Date':
+            mask &= date_mask(*date_bounds(operator, value))
+        elif column in ('Activity', 'Type'):
+            if operator not in (":", "="):
+                raise ValueError(f"{column.lower()} can only be matched with ':'")
+            mask &= category_mask(column, value)
+        elif column == 'Notes':
+            mask &= notes_mask(value)
+        else:
+            mask &= number_mask(column, operator, value)
+    return mask
+
+#Activities matching a structured query, in date order
+def query_search(query):
+    return live_rows(activities[query_mask(query).to_numpy()])
+
+#IDs of the activities matching every given condition; deleted rows never match
+def matching_ids(start_date=None, end_date=None, activity=None, activity_type=None, keyword=None, query=None):
+    if connection is not None:
+        terms = parse_query(query) if query else []
+        terms += [(column, ":", value) for column, value in (('Activity', activity), ('Type', activity_type), (None, keyword)) if value]
+        return pd.Index([rowid for (rowid,) in sqlite_matches(terms, start_date, end_date)])
+    mask = date_mask(start_date, end_date)
+    if activity:
+        mask &= category_mask('Activity', activity)
+    if activity_type:
+        mask &= category_mask('Type', activity_type)
+    if keyword:
+        mask &= keyword_mask(keyword)
+    if query:
+        mask &= query_mask(query)
+    if tombstones:
+        mask &= ~activities.index.isin(tombstones)
+    return activities.index[mask.to_numpy()]
+
+#Period keys of each row, one Series per rollup period
+def period_keys(dates):
+    iso = dates.dt.isocalendar()
+    return {
+        "day": dates.dt.strftime("%Y-%m-%d"),
+        "week": iso['year'].astype(str) + "-W" + iso['week'].astype(str).str.zfill(2),
+        "month": dates.dt.strftime("%Y-%m"),
+    }
+
+#Rows with Distance and Calorie widened to float64; float32 sums over years of rows drift visibly
+def widen_measures(rows):
+    return rows.astype({"Distance": "float64", "Calorie": "float64"})
+
+#Add rows to the rollups (sign=-1 takes them out again)
+def update_rollups(rows, sign=1):
+    if rows.empty or not memory_indexes:
+        return
+    rows = widen_measures(rows)
+    for period, keys in period_keys(rows['Date']).items():
+        grouped = rows.groupby(keys).agg(
+            count=('Date', 'size'),
+            distance=('Distance', 'sum'),
+            calories=('Calorie', 'sum'),
+            duration=('Duration', 'sum'),
+            duration_count=('Duration', 'count'),
+        )
+        period_totals = rollups[period]
+        changed_periods[period].update(grouped.index)
+        for key, values in zip(grouped.index, grouped.to_dict("records")):
+            totals = period_totals.setdefault(key, new_totals())
+            for field, value in values.items():
+                totals[field] += sign * value
+            if totals["count"] <= 0:
+                del period_totals[key]
+
+#Keep the rollups and personal records in step with rows being added (sign=-1: removed)
+def update_statistics(rows, sign=1):
+    update_rollups(rows, sign)
+    update_records(rows, sign)
+
+#Rebuild the rollups for the whole journal
+def build_rollups():
+    for period_totals in rollups.values():
+        period_totals.clear()
+    update_rollups(activities)
+
+#Save the rollups, tied to the current data_file like the log is: append the changed periods to the delta file,
+#or rewrite rollup_file in full (and drop the deltas) when folding or when full is set
+def save_rollups(full=False):
+    global rollup_deltas
+    delta_file = rollup_file + ".delta"
+    if not full and rollup_deltas < rollup_fold_threshold and os.path.exists(rollup_file):
+        changes = {period: {key: rollups[period].get(key) for key in keys} for period, keys in changed_periods.items()}
+        line = json.dumps({"base": base_signature(), "rollups": changes, "next_id": next_label}) + "\n"
+        with open(delta_file, "a") as f:
+            f.write(line)
+        rollup_deltas += 1
+        count_io(written=len(line.encode()))
+    else:
+        temp_file = rollup_file + ".tmp"
+        with open(temp_file, "w") as f:
+            json.dump({"base": base_signature(), "rollups": rollups, "next_id": next_label}, f)
+        os.replace(temp_file, rollup_file)
+        if os.path.exists(delta_file):
+            os.remove(delta_file)
+        rollup_deltas = 0
+        count_io(written=os.path.getsize(rollup_file))
+    for keys in changed_periods.values():
+        keys.clear()
+
+#Deltas appended to rollup_file + ".delta", oldest first; a torn last line is left out
+def read_rollup_deltas():
+    try:
+        with open(rollup_file + ".delta") as f:
+            lines = f.readlines()
+    except OSError:
+        return []
+    deltas = []
+    for line in lines:
+        try:
+            deltas.append(json.loads(line))
+        except ValueError:
+            break
+    return deltas
+
+#Load saved rollups if they match data_file, otherwise rebuild and save them
+def load_rollups():
+    global next_label, rollup_deltas
+    for keys in changed_periods.values():
+        keys.clear()
+    try:
+        with open(rollup_file) as f:
+            saved = json.load(f)
+    except (OSError, ValueError):
+        saved = None
+    deltas = []
+    if saved is not None:
+        deltas = read_rollup_deltas()
+        #The next ID holds even when the rollups themselves are out of date
+        next_label = max([next_label] + [entry.get("next_id", 1) for entry in [saved] + deltas])
+    #The last delta (or the full file) must have been written against data_file as it is now
+    if saved is not None and (deltas[-1] if deltas else saved).get("base") == base_signature():
+        for period in rollups:
+            rollups[period] = saved["rollups"][period]
+        for delta in deltas:
+            for period, changes in delta["rollups"].items():
+                for key, totals in changes.items():
+                    if totals is None:
+                        rollups[period].pop(key, None)
+                    else:
+                        rollups[period][key] = totals
+        rollup_deltas = len(deltas)
+        return
+    build_rollups()
+    if os.path.exists(data_file):
+        save_rollups(full=True)
+
+#Totals between two dates for the loaded journal
+def summary_totals(start_date, end_date):
+    if connection is not None:
+        return sqlite_totals(start_date, end_date)
+    return rollup_totals(start_date, end_date)
+
+#Totals between two dates from the rollups, using whole months and weeks where they fit
+def rollup_totals(start_date, end_date):
+    totals = new_totals()
+    day = start_date.date() if hasattr(start_date, "date") else start_date
+    end = end_date.date() if hasattr(end_date, "date") else end_date
+    while day <= end:
+        next_month = (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+        if day.day == 1 and next_month - timedelta(days=1) <= end:
+            period, key, day = "month", day.strftime("%Y-%m"), next_month
+        elif day.weekday() == 0 and day + timedelta(days=6) <= end:
+            year, week, _ = day.isocalendar()
+            period, key, day = "week", f"{year}-W{week:02d}", day + timedelta(days=7)
+        else:
+            period, key, day = "day", day.strftime("%Y-%m-%d"), day + timedelta(days=1)
+        if key in rollups[period]:
+            merge_totals(totals, rollups[period][key])
+    return totals
+
+#Score of each row for each personal record, NaN where it does not apply; pace is minutes per km,
+#negated so that a higher score is always better
+def record_scores(rows):
+    distance = rows['Distance'].astype(float)
+    moving = (distance > 0) & (rows['Duration'] > 0)
+    return {
+        "distance": distance.where(distance > 0),
+        "pace": -(rows['Duration'] / distance).where(moving),
+        "calories": rows['Calorie'].astype(float).where(rows['Calorie'] > 0),
+    }
+
+#Forget the record heaps; they are built again on first use
+def reset_records():
+    global records_built
+    for heaps in personal_records.values():
+        heaps.clear()
+    stale_records.clear()
+    records_built = False
+
+#Build the record heaps of the given activities (every activity when None) with one nlargest per group
+def build_records(names=None):
+    global records_built
+    rows = live_rows(activities)
+    if names is not None:
+        rows = rows[rows['Activity'].isin(names)]
+    for metric, scores in record_scores(rows).items():
+        heaps = personal_records[metric]
+        for name in (list(heaps) if names is None else names):
+            heaps.pop(name, None)
+        best = scores.dropna().groupby(rows['Activity'], observed=True).nlargest(record_size)
+        for (activity, label), score in best.items():
+            heaps.setdefault(activity, []).append((float(score), int(label)))
+        for activity in best.index.get_level_values(0).unique():
+            heapq.heapify(heaps[activity])
+    records_built = True
+
+#Push added rows into the record heaps; removing a row that holds a record marks its activity stale
+def update_records(rows, sign=1):
+    if not records_built or rows.empty:
+        return
+    if sign < 0:
+        for label, activity in zip(rows.index, rows['Activity']):
+            if any(entry[1] == label for heaps in personal_records.values() for entry in heaps.get(activity, ())):
+                stale_records.add(activity)
+        return
+    for metric, scores in record_scores(rows).items():
+        heaps = personal_records[metric]
+        for label, activity, score in zip(rows.index, rows['Activity'], scores):
+            if pd.isna(score):
+                continue
+            heap = heaps.setdefault(activity, [])
+            entry = (float(score), int(label))
+            if len(heap) < record_size:
+                heapq.heappush(heap, entry)
+            elif entry > heap[0]:
+                heapq.heapreplace(heap, entry)
+
+#The record heaps, building or refreshing them first if needed
+def current_records():
+    if not records_built:
+        build_records()
+    elif stale_records:
+        build_records(sorted(stale_records))
+        stale_records.clear()
+    return personal_records
 
+#Date of the latest activity that has not been deleted
+def latest_date():
+    position = len(activities) - 1
+    while activities.index[position] in tombstones:
+        position -= 1
+    return activities['Date'].iloc[position]
+
+#Totals per Activity or Type between two dates, from one groupby over the date slice; memoized per journal version
+def breakdown(column, start_date, end_date):
+    key = (column, start_date, end_date, journal_version)
+    if key not in breakdown_cache:
+        #Entries for older versions can never be used again
+        for stale in [cached for cached in breakdown_cache if cached[-1] != journal_version]:
+            del breakdown_cache[stale]
+        if connection is not None:
+            grouped = sqlite_breakdown(column, start_date, end_date)
+        else:
+            rows = widen_measures(rows_between(start_date, end_date))
+            grouped = rows.groupby(column, observed=True).agg(
+                Activities=('Date', 'size'),
+                Distance=('Distance', 'sum'),
+                Calories=('Calorie', 'sum'),
+                Duration=('Duration', 'sum'),
+                Average_Duration=('Duration', 'mean'),
+            )
+        breakdown_cache[key] = grouped.sort_values('Activities', ascending=False, kind="stable")
+    return breakdown_cache[key]
+
+#Totals per day, week or month between two dates, from one grouped pass over the date slice;
+#every bin from the one holding start_date to the one holding end_date is included, empty ones as zeros
+def trend(start_date, end_date, every):
+    frequency, label_format = trend_bins[every]
+    if connection is not None:
+        grouped = sqlite_trend(start_date, end_date, every)
+    else:
+        rows = widen_measures(rows_between(start_date, end_date))
+        grouped = rows.groupby(pd.Grouper(key='Date', freq=frequency, label="left", closed="left")).agg(
+            Activities=('Date', 'size'),
+            Distance=('Distance', 'sum'),
+            Calories=('Calorie', 'sum'),
+            Duration=('Duration', 'sum'),
+        )
+    #Bins start on the day, on the Monday of the week or on the 1st of the month
+    first = pd.Timestamp(start_date).normalize()
+    if every == "week":
+        first -= pd.Timedelta(days=first.weekday())
+    elif every == "month":
+        first = first.replace(day=1)
+    grouped = grouped.reindex(pd.date_range(first, end_date, freq=frequency), fill_value=0)
+    grouped = grouped.round(2)
+    grouped.index = grouped.index.strftime(label_format).rename(every.capitalize())
+    return grouped
+
+#Average distance, calories, duration and sessions per day over the days ending on end_date, from the rollups
+def rolling_averages(end_date, days):
+    totals = summary_totals(end_date - timedelta(days=days - 1), end_date)
+    return {key: totals[key] / days for key in ("count", "distance", "calories", "duration")}
+
+#Make sure the journal's categorical columns know every value in values
+def add_categories(column, values):
+    global activities
+    new = pd.Index(pd.Series(values).dropna().unique()).difference(activities[column].cat.categories)
+    if len(new):
+        activities[column] = activities[column].cat.add_categories(new)
+
+#Give new rows exactly the journal's column types, so concat keeps them compact
+def conform(rows):
+    duration = pd.to_numeric(rows['Duration'])
+    if ((duration <= 0) | (duration > max_duration)).any():
+        raise ValueError(f"duration must be between 1 and {max_duration} minutes")
+    for column in columns:
+        if column_types.get(column) == "category":
+            add_categories(column, rows[column])
+        rows[column] = rows[column].astype(activities[column].dtype)
+    return rows
+
+#ID of the row an edit or delete refers to; logs written before IDs existed give its position instead
+def op_label(op):
+    label = op["id"] if "id" in op else live_rows(activities).index[op["index"]]
+    if not has_activity(label):
+        raise KeyError(f"there is no activity with ID {label}")
+    return label
+
+#Apply an add/import/edit/delete (or bulk edit/delete) operation to the in-memory journal
+#Edits and deletes address rows by ID
+def apply_operation(op):
+    global activities, next_label, journal_version
+    journal_version += 1
+    if op["op"] in add_ops:
+        #Logs written before adds carried their ID continue from next_label
+        start = op.get("id", next_label)
+        count = 1 if op["op"] == "add" else len(op["rows"])
+        if activities.index.isin(range(start, start + count)).any():
+            raise ValueError(f"IDs {start} to {start + count - 1} are already taken")
+        next_label = max(next_label, start + count)
+    if op["op"] == "add":
+        new_row = pd.DataFrame([op["row"]], columns=columns, index=[start])
+        new_row['Date'] = pd.to_datetime(new_row['Date'], format=date_format)
+        insert_row(conform(new_row))
+        index_rows(new_row)
+        update_statistics(new_row)
+    elif op["op"] == "import":
+        new_rows = pd.DataFrame(op["rows"], columns=columns)
+        new_rows.index = range(start, start + count)
+        new_rows['Date'] = pd.to_datetime(new_rows['Date'], format=date_format)
+        conform(new_rows)
+        #One concat and one stable sort; imported rows land after existing rows on the same date
+        activities = pd.concat([piece for piece in (activities, new_rows) if len(piece)])
+        activities = activities.sort_values('Date', kind="stable")
+        index_rows(new_rows)
+        update_statistics(new_rows)
+    elif op["op"] == "edit":
+        label = op_label(op)
+        #Convert every value first, so a bad one fails before the journal is touched
+        values = {column: edit_value(column, value) for column, value in op["changes"].items()}
+        unindex_row(label)
+        update_statistics(activities.loc[[label]], -1)
+        for column, value in values.items():
+            activities.at[label, column] = value
+        if 'Date' in op["changes"]:
+            #Move the row to its new place in date order
+            row = activities.loc[[label]]
+            activities = activities.drop(label)
+            insert_row(row)
+        index_rows(activities.loc[[label]])
+        update_statistics(activities.loc[[label]])
+    elif op["op"] == "delete":
+        #Tombstone the row instead of copying the journal without it
+        label = op_label(op)
+        unindex_row(label)
+        update_statistics(activities.loc[[label]], -1)
+        tombstones.add(label)
+        if len(tombstones) >= tombstone_threshold:
+            purge_tombstones()
+    elif op["op"] == "bulk_edit":
+        labels = op["ids"]
+        missing = [label for label in labels if not has_activity(label)]
+        if missing:
+            raise KeyError(f"there is no activity with ID {missing[0]}")
+        values = {column: edit_value(column, value) for column, value in op["changes"].items()}
+        for label in labels:
+            unindex_row(label)
+        update_statistics(activities.loc[labels], -1)
+        #One assignment per changed column, however many rows match
+        for column, value in values.items():
+            activities.loc[labels, column] = value
+        if 'Date' in op["changes"]:
+            activities = activities.sort_values('Date', kind="stable")
+        index_rows(activities.loc[labels])
+        update_statistics(activities.loc[labels])
+    elif op["op"] == "bulk_delete":
+        labels = op["ids"]
+        missing = [label for label in labels if not has_activity(label)]
+        if missing:
+            raise KeyError(f"there is no activity with ID {missing[0]}")
+        for label in labels:
+            unindex_row(label)
+        update_statistics(activities.loc[labels], -1)
+        tombstones.update(labels)
+        if len(tombstones) >= tombstone_threshold:
+            purge_tombstones()
+
+#A changed field's value in the journal's column type
+def edit_value(column, value):
+    if column == 'Date':
+        return pd.to_datetime(value, format=date_format)
+    if column == 'Duration':
+        value = int(value)
+        if not 0 < value <= max_duration:
+            raise ValueError(f"duration must be between 1 and {max_duration} minutes")
+        return value
+    if column_types.get(column) == "category":
+        add_categories(column, [value])
+    return value
+
+#Number of rows an operation touches
+def op_rows(op):
+    if op["op"] == "import":
+        return len(op["rows"])
+    if op["op"] in bulk_ops:
+        return len(op["ids"])
+    return 1
+
+#Convert numpy scalars so they can be written as JSON
+def json_value(value):
+    return value.item() if hasattr(value, "item") else str(value)
+
+#Apply an operation and queue it for the log; the saver thread writes it shortly after
+def record(op):
+    global pending_ops, log_adds_only
+    if connection is not None:
+        sqlite_apply(op)
+        apply_operation(op)
+        count_io(rows=op_rows(op))
+        return
+    if op["op"] in add_ops:
+        op["id"] = allocate_ids(op_rows(op))
+    line = json.dumps(op, default=json_value) + "\n"
+    with journal_lock:
+        #Only queue the change once it has applied, so the log never holds one that fails on replay
+        apply_operation(op)
+        session_lines.append(line)
+        if write_ahead:
+            unsaved_lines.append(line)
+        count_io(rows=op_rows(op))
+        pending_ops += 1
+        log_adds_only = log_adds_only and op["op"] in add_ops
+    if write_ahead:
+        request_save()
+
+#Wake the saver thread, starting it on first use
+def request_save():
+    global saver
+    if saver is None:
+        saver = threading.Thread(target=saver_loop, name="journal-saver", daemon=True)
+        saver.start()
+    save_wakeup.set()
+
+#Wait for changes to stop arriving (up to save_max_delay), then write them all at once
+def saver_loop():
+    while True:
+        save_wakeup.wait()
+        save_wakeup.clear()
+        deadline = time.monotonic() + save_max_delay
+        while time.monotonic() < deadline and save_wakeup.wait(save_delay):
+            save_wakeup.clear()
+        try:
+            flush_saves()
+        except Exception as e:
+            #The lines stay queued and the thread keeps running, so the next change or the exit flush retries them
+            print(f"\nCould not save changes to {log_file}: {e}")
+
+#Write queued log lines with one fsync, compacting once enough changes have built up
+def flush_saves():
+    with journal_lock:
+        if not unsaved_lines:
+            return
+        text = "".join(unsaved_lines)
+        with file_lock():
+            new_log = not os.path.exists(log_file) or os.path.getsize(log_file) == 0
+            with open(log_file, "a") as f:
+                if new_log:
+                    f.write(json.dumps({"base": base_signature(), "next_id": base_label}) + "\n")
+                f.write(text)
+                f.flush()
+                os.fsync(f.fileno())
+        count_io(written=len(text.encode()))
+        unsaved_lines.clear()
+        if pending_ops >= compact_threshold:
+            compact_data()
+
+#Fold the log into data_file (this also flushes the saver's queue): append to a CSV when only adds are pending, otherwise rewrite
+@instrumented("compact_data")
+def compact_data():
+    global base_label, pending_ops, log_adds_only, ids_stored, journal_base
+    if connection is not None:
+        #Only batch mode leaves a SQLite transaction open
+        connection.commit()
+        return
+    with journal_lock, file_lock():
+        if pending_ops == 0:
+            return
+        logged = logged_lines()
+        if base_signature() != journal_base or not set(logged) <= set(session_lines):
+            rebase(logged)
+        if log_adds_only and ids_stored and journal_format(data_file) == "csv":
+            #Rows added since the last compaction are the ones with IDs from base_label up
+            append_data(activities[activities.index >= base_label])
+        else:
+            save_data()
+            ids_stored = True
+        save_rollups()
+        if os.path.exists(log_file):
+            os.remove(log_file)
+        #Everything still queued for the log is now in data_file
+        unsaved_lines.clear()
+        session_lines.clear()
+        journal_base = base_signature()
+        base_label = next_label
+        pending_ops = 0
+        log_adds_only = True
+
+#Lines in the log after its header (none when there is no log)
+def logged_lines():
+    try:
+        with open(log_file) as f:
+            return f.readlines()[1:]
+    except OSError:
+        return []
+
+#Another session saved the journal or logged changes since this one loaded it: load data_file and the log
+#again, then redo this session's changes that are not in them yet; ones no longer possible (an edit of a row
+#the other session deleted) are skipped. The result is written in full
+def rebase(logged):
+    global pending_ops, log_adds_only
+    logged = set(logged)
+    mine = [line for line in session_lines if line not in logged]
+    load_data()
+    for line in mine:
+        try:
+            apply_operation(json.loads(line))
+        except Exception:
+            continue
+    pending_ops += len(mine) + 1
+    log_adds_only = False
+
+@instrumented("add")
 def add():
     global activities
     
@@ -157,8 +1654,8 @@ def add():
         try:
             #Convert input to integer
             duration = int(raw_input)  
-            if duration <= 0:
-                print("Please enter a positive integer.")
+            if not 0 < duration <= max_duration:
+                print(f"Please enter a positive integer no larger than {max_duration}.")
                 # Reset to re-prompt
                 duration = None  
         except ValueError:
@@ -190,7 +1687,7 @@ def add():
             print("Date cannot be empty. Please try again.")
             continue
         try:
-            date = datetime.strptime(date_input, "%d/%m/%Y").strftime("%d/%m/%Y")
+            date = datetime.strptime(date_input, date_format).strftime(date_format)
         except ValueError:
             print("Invalid date format. Please enter the date in DD/MM/YYYY format.")
 
@@ -207,45 +1704,42 @@ def add():
         "Notes": notes
     }
 
-    # Add the new data to DataFrame and save
-    activities = pd.concat([activities, pd.DataFrame([new_entry])], ignore_index=True)
-    save_data()
+    # Log the new entry and add it to the DataFrame
+    record({"op": "add", "row": new_entry})
     print("New activity added!")
 
 #Function to edit data to journal
+@instrumented("edit")
 def edit():
     global activities
-    if activities.empty:
+    if activity_count() == 0:
         print("No activities found to edit.")
         return
 
-    #Reset index for display purposes and show current records
-    details_df = activities.reset_index(drop=True)
-    # Start index from 1
-    details_df.index += 1  
-    print("Record of activities:")
-    print("-" * 40)
-    print(details_df)
+    #Show current records a page at a time
+    browse("Record of activities:")
 
-    #Get the index of the activity to edit (adjust to zero-based index for DataFrame access)
-    index = getInput(
-        "Enter the index of the activity you want to edit: ",
-        "Please enter a valid index.",
+    #Get the ID of the activity to edit
+    label = getInput(
+        "Enter the ID of the activity you want to edit: ",
+        "Please enter the ID of an activity in the journal.",
         int,
-        lambda x: 1 <= x <= len(details_df)
-    ) - 1
+        lambda x: has_activity(x)
+    )
+    if label is None:
+        return
 
     #Access the current row
-    current_row = activities.iloc[index]
+    current_row = activities.loc[label]
 
     #Prompt for new values (keep existing if no input is given)
     new_activity = input(f"Rename this activity name (or press Enter to keep '{current_row['Activity']}'): ").strip()
     new_type = input(f"Rename this activity type (or press Enter to keep '{current_row['Type']}'): ").strip()
     new_duration = getInput(
         f"Enter the new duration (or press Enter to keep '{current_row['Duration']}'): ",
-        "Please enter a positive integer.",
+        f"Please enter a positive integer no larger than {max_duration}.",
         lambda x: int(x) if x.strip() else current_row['Duration'],
-        lambda x: x > 0
+        lambda x: 0 < x <= max_duration
     )
 
     new_distance = getInput(
@@ -262,120 +1756,159 @@ def edit():
         lambda x: x >= 0
     )
     new_date = getInput(
-        f"Enter the new date (DD/MM/YYYY) (or press Enter to keep '{current_row['Date']}'): ",
+        f"Enter the new date (DD/MM/YYYY) (or press Enter to keep '{current_row['Date'].strftime(date_format)}'): ",
         "Please enter a valid date in DD/MM/YYYY format.",
-        lambda x: datetime.strptime(x, "%d/%m/%Y").date() if x else current_row['Date'],
+        lambda x: datetime.strptime(x, date_format).date() if x else current_row['Date'],
         lambda x: x or x == "" 
     )
 
-    if new_date == None:
-        new_date = current_row['Date']
-    else:
-        new_date = new_date.strftime("%d/%m/%Y")
-        
     new_notes = input(f"Enter new additional notes (or press Enter to keep '{current_row['Notes']}'): ").strip()
 
-    #Update the row directly in the DataFrame
+    #Collect the changed fields
+    changes = {}
     if new_activity:
-        activities.at[index, 'Activity'] = new_activity
+        changes['Activity'] = new_activity
     if new_type:
-        activities.at[index, 'Type'] = new_type
+        changes['Type'] = new_type
     if new_duration:
-        activities.at[index, 'Duration'] = float(new_duration)
+        changes['Duration'] = float(new_duration)
     if new_distance:
-        activities.at[index, 'Distance'] = float(new_distance)
+        changes['Distance'] = float(new_distance)
     if new_calorie:
-        activities.at[index, 'Calorie'] = float(new_calorie)
-    if new_date:
-        try:
-            #Validate and reformat the date
-            formatted_date = datetime.strptime(new_date, "%d/%m/%Y").strftime("%d/%m/%Y")
-            activities.at[index, 'Date'] = formatted_date
-        except ValueError:
-            print("Invalid date format. Keeping the existing date.")
+        changes['Calorie'] = float(new_calorie)
+    if new_date is not None:
+        changes['Date'] = new_date.strftime(date_format)
     if new_notes:
-        activities.at[index, 'Notes'] = new_notes
+        changes['Notes'] = new_notes
 
-    #Save changes to file
-    save_data()
+    #Log the changes and update the row in the DataFrame
+    record({"op": "edit", "id": label, "changes": changes})
     print("Activity updated successfully!")
 
 
 #Function to delete data from journal
+@instrumented("delete")
 def delete():
     global activities
-    if activities.empty:
+    if activity_count() == 0:
         print("No activities found to delete.")
         return
     
-    #Display available activities
-    details_df = activities.reset_index(drop=True)
-    details_df.index += 1
-    print("Available activities:")
-    print("-" * 40)
-    print(details_df)
+    #Display available activities a page at a time
+    browse("Available activities:")
 
-    index = getInput(
-        "Enter the index of the activity you want to delete: ",
-        "Please enter a valid index.",
+    label = getInput(
+        "Enter the ID of the activity you want to delete: ",
+        "Please enter the ID of an activity in the journal.",
         int,
-        lambda x: 1 <= x <= len(details_df)
+        lambda x: has_activity(x)
     )
+    if label is None:
+        return
 
-    actual_index = index - 1
-    
-    activities.drop(activities.index[actual_index], inplace=True)
-    activities.reset_index(drop=True, inplace=True)
-    save_data()
+    record({"op": "delete", "id": label})
     print("Activity deleted successfully!")
 
 #Function to view activity details in journal
+@instrumented("details")
 def details():
     #Check if DataFrame is empty
-    if activities.empty:
+    if activity_count() == 0:
         #Output if no activities
         print("No activities found.")
         return
 
-    print("\nRecord of activities:")
-    print("-" * 40)
+    browse("\nRecord of activities:")
 
-    details_df = activities.reset_index(drop=True)
-    details_df.index += 1  
+#Print one page of a journal with each activity's ID; only that window is copied
+#Rows as listings show them: dates written like every prompt expects them (DD/MM/YYYY), IDs as the index
+def listing(rows):
+    return rows.assign(Date=rows['Date'].dt.strftime(date_format)).rename_axis(id_column)
 
-    #Display details
-    print(details_df)
+#Sorted positions of the tombstoned rows in activities
+def deleted_positions():
+    return np.sort(activities.index.get_indexer(list(tombstones)))
+
+#Show one page of live rows; only the page's window of activities is sliced. The saver thread can compact
+#(and so drop tombstoned rows) between pages, so the deleted positions are worked out again under the lock
+def show_page(page):
+    with journal_lock:
+        deleted = deleted_positions()
+        #Each deleted row before a live row pushes it one position further down activities
+        start = page * page_size
+        start += np.searchsorted(deleted - np.arange(len(deleted)), start, side="right")
+        window = activities.iloc[start:start + page_size + len(deleted)]
+        print(listing(live_rows(window).head(page_size)))
+        count = activity_count()
+    pages = max(1, -(-count // page_size))
+    print(f"Page {page + 1} of {pages} ({count} activities)")
+
+#Page through the journal (deleted rows left out): next/previous page, jump to a page or to a date,
+#or change the page size (kept for later listings)
+def browse(title):
+    global page_size
+    print(title)
+    print("-" * 40)
+    page = 0
+    while True:
+        show_page(page)
+        pages = max(1, -(-activity_count() // page_size))
+        if pages == 1:
+            return
+        command = input("n = next page, p = previous page, a page number, a date (DD/MM/YYYY) or s <rows> for the page size; "
+                        "Enter when done: ").strip().lower()
+        if command == "":
+            return
+        if command == "n":
+            page = min(page + 1, pages - 1)
+        elif command == "p":
+            page = max(page - 1, 0)
+        elif command.isdigit() and 1 <= int(command) <= pages:
+            page = int(command) - 1
+        elif command.startswith("s") and command[1:].strip().isdigit():
+            size = int(command[1:])
+            low, high = page_size_limits
+            if not low <= size <= high:
+                print(f"Page size must be between {low} and {high} rows.")
+                continue
+            #Stay on the page holding the first row shown so far
+            page = page * page_size // size
+            page_size = size
+        else:
+            try:
+                date = datetime.strptime(command, date_format)
+            except ValueError:
+                print("Please enter n, p, a page number between 1 and " + str(pages) + ", a date in DD/MM/YYYY format "
+                      "or s followed by a page size.")
+                continue
+            #The journal is sorted by date, so the first activity on or after the date is found by bisection;
+            #deleted rows before it do not count towards its page
+            with journal_lock:
+                position = activities['Date'].searchsorted(date, side="left")
+                position -= np.searchsorted(deleted_positions(), position, side="left")
+                page = min(position, activity_count() - 1) // page_size
 
 #Function to search desired data in journal
+@instrumented("search")
 def search():
     global activities
     
     try:
-        if activities.empty:
+        if activity_count() == 0:
             raise ValueError("No activities found to search.")
         
         query = getInput(
-            "Enter a keyword to search (e.g., activity name, type, or date): ",
+            "Enter a keyword to search (e.g., activity name, type, or date) or a query such as activity:cycling distance>10: ",
             "Search query cannot be empty.",
             lambda x: x.strip().lower(),
             lambda x: len(x) > 0
         )
-        
-        results = activities[
-            activities.apply(lambda row: query in str(row.values).lower(), axis=1)
-        ]
+        if query is None:
+            raise ValueError("Search query cannot be empty.")
+        #Close matches rank rows by similarity, so 'running' also finds 'runnings'
+        fuzzy = not is_structured(query) and input("Show close matches too (e.g. misspellings)? (y/N): ").strip().lower() == "y"
 
-        #Display if no results
-        if results.empty:
-            print("No matching activities found.")
-        else:
-            #Display if data found
-            print("\nSearch Results:")
-            print("-" * 40)
-            results_df = results.reset_index(drop=True)
-            results_df.index += 1
-            #Output filtered results
-            print(results_df)
+        print_results(find_activities(query, fuzzy))
     #Occur for ValueError
     except ValueError as e:
         print(f"Error: {e}")
@@ -383,49 +1916,611 @@ def search():
     except Exception as e:
         print(f"An unexpected error occurred: {e}")
 
-#Function to display summary between chosen periods
+#Run a structured query, or look up whole keywords in the index, then fall back to partial words
+#and finally to close matches
+def find_activities(query, fuzzy=False):
+    if is_structured(query):
+        if connection is not None:
+            return rows_with_ids(sqlite_matches(parse_query(query)))
+        return query_search(query)
+    if connection is not None:
+        if fuzzy:
+            print("Fuzzy search is not available for SQLite journals; showing normal results.")
+        return sqlite_search(query)
+    if fuzzy:
+        return fuzzy_search(query)
+    results = keyword_search(query)
+    if results.empty:
+        results = substring_search(query)
+    if results.empty:
+        results = fuzzy_search(query)
+        if not results.empty:
+            print("No exact matches; showing close matches instead.")
+    return results
+
+#Display search results
+def print_results(results):
+    #Display if no results
+    if results.empty:
+        print("No matching activities found.")
+    else:
+        #Display if data found
+        print("\nSearch Results:")
+        print("-" * 40)
+        #Output filtered results with their IDs, ready for edit or delete
+        print(listing(results))
+
+#Function to display summary between chosen periods, or the personal records
+@instrumented("display_summary")
 def display_summary():
-    if activities.empty:
+    if activity_count() == 0:
         print("No activities found to summarize.")
         return
 
+    print("1. Totals between two dates")
+    print("2. Personal records and rolling averages")
+    print("3. Totals per activity and per type between two dates")
+    print("4. Daily, weekly or monthly trend between two dates")
+    choice = getInput(
+        "Enter your summary choice (1-4): ",
+        "Please enter a number between 1 and 4.",
+        int,
+        lambda x: x in range(1, 5),
+    )
+    if choice == 2:
+        print_records()
+        return
+
     #Prompt the user for the date range
     start_date = getInput(
         "Enter the start date (DD/MM/YYYY): ",
         "Invalid date format. Please enter in DD/MM/YYYY format.",
-        lambda x: datetime.strptime(x.strip(), "%d/%m/%Y"),
+        lambda x: datetime.strptime(x.strip(), date_format),
     )
 
     end_date = getInput(
         "Enter the end date (DD/MM/YYYY): ",
         "Invalid date format. Please enter in DD/MM/YYYY format.",
-        lambda x: datetime.strptime(x.strip(), "%d/%m/%Y"),
+        lambda x: datetime.strptime(x.strip(), date_format),
     )
 
-    #Filter activities within the date range
-    def within_date_range(row):
-        activity_date = datetime.strptime(row, "%d/%m/%Y")
-        return start_date <= activity_date <= end_date
+    if choice == 3:
+        print_breakdown(list(breakdown_columns.values()), start_date, end_date)
+        return
+    if choice == 4:
+        every = getInput(
+            "Enter the bin size (day, week or month): ",
+            "Please enter day, week or month.",
+            lambda x: x.strip().lower(),
+            lambda x: x in trend_bins,
+        ) or "week"
+        csv_file = input("Enter a CSV file to save the trend to (or press Enter to show it): ").strip()
+        print_trend(start_date, end_date, every, csv_file or None)
+        return
+    #Totals for the date range come from the calendar rollups (or an indexed SQLite query)
+    print_summary(summary_totals(start_date, end_date))
+
+#Empty running totals for a summary; totals from separate chunks or files can be merged
+def new_totals():
+    return {"count": 0, "distance": 0.0, "calories": 0.0, "duration": 0.0, "duration_count": 0}
+
+#Add the rows of one slice or chunk to the totals
+def add_totals(totals, rows):
+    totals["count"] += len(rows)
+    totals["distance"] += float(rows['Distance'].astype("float64").sum())
+    totals["calories"] += float(rows['Calorie'].astype("float64").sum())
+    totals["duration"] += float(rows['Duration'].sum())
+    totals["duration_count"] += int(rows['Duration'].count())
 
-    filtered_activities = activities[activities['Date'].apply(within_date_range)]
+#Fold other totals into totals
+def merge_totals(totals, other):
+    for key in totals:
+        totals[key] += other[key]
 
-    if filtered_activities.empty:
+#Display the summary for the totals
+def print_summary(totals):
+    if totals["count"] == 0:
         print("No activities found in the specified date range.")
         return
 
-    #Calculate total distance, total calories burned, and average duration
-    total_distance = filtered_activities['Distance'].sum()
-    total_calories = filtered_activities['Calorie'].sum()
-    avg_duration = filtered_activities['Duration'].mean()
+    #Mean duration from the sums, so merged totals stay exact
+    avg_duration = totals["duration"] / totals["duration_count"] if totals["duration_count"] else 0.0
 
-    #Display the summary
     print("\nSummary of Fitness Data:")
     print("-" * 40)
-    print(f"Total Distance Covered: {total_distance:.2f} km")
-    print(f"Total Calories Burned: {total_calories:.2f}")
+    print(f"Total Distance Covered: {totals['distance']:.2f} km")
+    print(f"Total Calories Burned: {totals['calories']:.2f}")
     print(f"Average Workout Duration: {avg_duration:.2f} minutes")
     print("-" * 40)
 
+#Display the totals per value of each column (Activity, Type) between two dates
+def print_breakdown(by, start_date, end_date):
+    for column in by:
+        grouped = breakdown(column, start_date, end_date)
+        if grouped.empty:
+            print("No activities found in the specified date range.")
+            return
+        print(f"\nSummary by {column}:")
+        print("-" * 40)
+        print(grouped.round(2))
+    print("-" * 40)
+
+#Display a trend report as a table, or write it to a CSV file
+def print_trend(start_date, end_date, every, csv_file=None):
+    report = trend(start_date, end_date, every)
+    if report['Activities'].sum() == 0:
+        print("No activities found in the specified date range.")
+        return
+    if csv_file:
+        report.to_csv(csv_file)
+        print(f"Wrote {len(report)} {every}s to {csv_file}.")
+        return
+    print(f"\nTrend by {every}:")
+    print("-" * 40)
+    print(report.to_string())
+    print("-" * 40)
+
+#Value of a personal record for display
+def format_record(metric, score):
+    if metric == "distance":
+        return f"{score:.2f} km"
+    if metric == "calories":
+        return f"{score:.0f} calories"
+    minutes, seconds = divmod(round(-score * 60), 60)
+    return f"{minutes}:{seconds:02d} min/km"
+
+#Display each activity's personal records and the rolling averages up to the latest activity
+def print_records():
+    if activity_count() == 0:
+        print("No activities found.")
+        return
+    records = current_records()
+    print("\nPersonal Records:")
+    print("-" * 40)
+    names = {activity for heaps in records.values() for activity in heaps}
+    for activity in sorted(names, key=str):
+        print(f"{activity}:")
+        for metric, title in (("distance", "Longest distance"), ("pace", "Fastest pace"), ("calories", "Most calories")):
+            best = sorted(records[metric].get(activity, ()), reverse=True)
+            if best:
+                values = ", ".join(f"{format_record(metric, score)} ({activities.at[label, 'Date'].strftime(date_format)})"
+                                   for score, label in best)
+                print(f"  {title}: {values}")
+    end_date = latest_date()
+    print(f"\nRolling averages per day up to {end_date.strftime(date_format)}:")
+    for days in rolling_windows:
+        averages = rolling_averages(end_date, days)
+        print(f"Last {days} days: {averages['distance']:.2f} km, {averages['calories']:.0f} calories, "
+              f"{averages['duration']:.1f} minutes, {averages['count']:.2f} activities")
+    print("-" * 40)
+
+#Read a journal file chunk by chunk, only the given columns
+def read_journal_chunks(path, usecols=None):
+    file_format = journal_format(path)
+    if file_format == "parquet":
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size, columns=usecols):
+            yield batch.to_pandas()
+    elif file_format == "feather":
+        import pyarrow as pa
+        #Feather files are written in record batches, which can be read one at a time
+        reader = pa.ipc.open_file(pa.memory_map(path))
+        for i in range(reader.num_record_batches):
+            batch = reader.get_batch(i)
+            yield (batch.select(usecols) if usecols else batch).to_pandas()
+    else:
+        for chunk in pd.read_csv(path, usecols=usecols, chunksize=chunk_size):
+            chunk['Date'] = pd.to_datetime(chunk['Date'], format=date_format, errors="coerce")
+            yield chunk
+
+#Summarize a journal file between two dates without loading it, so memory stays bounded
+def stream_totals(path, start_date, end_date):
+    totals = new_totals()
+    for chunk in read_journal_chunks(path, summary_columns):
+        add_totals(totals, chunk[chunk['Date'].between(start_date, end_date)])
+    return totals
+
+#Journal files in a directory, or matching a glob pattern such as athletes/*.csv
+def journal_files(target):
+    if os.path.isdir(target):
+        paths = [os.path.join(target, name) for name in os.listdir(target)]
+    else:
+        paths = glob.glob(target)
+    return sorted(path for path in paths if os.path.isfile(path) and os.path.splitext(path)[1].lower() in storage_formats)
+
+#Totals of one journal file between two dates; runs in a worker process
+def journal_totals(path, start_date, end_date):
+    global data_file, log_file, rollup_file
+    if journal_format(path) == "sqlite":
+        db = open_sqlite(path)
+        try:
+            return sqlite_totals(start_date, end_date, db)
+        finally:
+            db.close()
+    if not os.path.exists(path + ".log"):
+        return stream_totals(path, start_date, end_date)
+    #Pending edits and deletes need a full load; the worker has its own copy of the journal globals.
+    #The athlete's files are only read: the log is replayed in memory and left as it is
+    data_file, log_file, rollup_file = path, path + ".log", path + ".rollups.json"
+    load_data(read_only=True)
+    totals = new_totals()
+    add_totals(totals, rows_between(start_date, end_date))
+    return totals
+
+#Summarize many athletes' journals in parallel, one task per file, then merge the totals
+def summarize_journals(target, start_date, end_date, workers=None):
+    paths = journal_files(target)
+    if not paths:
+        print(f"No journal files found in {target}.")
+        return None
+    combined = new_totals()
+    print(f"\n{'Athlete':<24}{'Sessions':>10}{'Distance (km)':>16}{'Calories':>12}{'Avg minutes':>13}")
+    print("-" * 75)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [(path, pool.submit(journal_totals, path, start_date, end_date)) for path in paths]
+        for path, future in futures:
+            athlete = os.path.splitext(os.path.basename(path))[0]
+            try:
+                totals = future.result()
+            except Exception as e:
+                print(f"{athlete:<24}could not be read: {e}")
+                continue
+            merge_totals(combined, totals)
+            avg_duration = totals["duration"] / totals["duration_count"] if totals["duration_count"] else 0.0
+            print(f"{athlete:<24}{totals['count']:>10}{totals['distance']:>16.2f}{totals['calories']:>12.2f}{avg_duration:>13.2f}")
+    print_summary(combined)
+    return combined
+
+#Read an import file (CSV or JSON Lines) as text columns, numbering rows from 1
+#JSON lines that cannot be parsed are returned as rejects
+def read_import_file(path):
+    rejects = []
+    if path.lower().endswith((".jsonl", ".ndjson", ".json")):
+        records = []
+        numbers = []
+        with open(path) as f:
+            for number, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                    if not isinstance(record, dict):
+                        raise ValueError
+                except ValueError:
+                    rejects.append((number, "not a JSON object"))
+                    continue
+                records.append(record)
+                numbers.append(number)
+        rows = pd.DataFrame(records, index=numbers, dtype=object)
+    else:
+        rows = pd.read_csv(path, dtype=str, skipinitialspace=True)
+        rows.index = range(1, len(rows) + 1)
+    return rows.reindex(columns=columns), rejects
+
+#Check imported rows against the same rules as add(), all at once
+#Returns the valid rows ready to log and (row number, reason) for every reject
+def validate_import(rows):
+    text = {column: rows[column].astype("string").str.strip() for column in ("Activity", "Type", "Notes")}
+    duration = pd.to_numeric(rows['Duration'], errors="coerce")
+    distance = pd.to_numeric(rows['Distance'], errors="coerce")
+    calorie = pd.to_numeric(rows['Calorie'], errors="coerce")
+    date = pd.to_datetime(rows['Date'].astype("string").str.strip(), format=date_format, errors="coerce")
+
+    checks = [
+        (text['Activity'].fillna("") == "", "Activity name cannot be empty"),
+        (text['Type'].fillna("") == "", "Activity type cannot be empty"),
+        (duration.isna() | (duration <= 0) | (duration > max_duration) | (duration % 1 != 0),
+         f"Duration must be a positive integer no larger than {max_duration}"),
+        (rows['Distance'].notna() & (distance.isna() | (distance < 0)), "Distance must be a non-negative number"),
+        (calorie.isna() | (calorie < 0), "Calories must be a non-negative number"),
+        (date.isna(), "Date must be in DD/MM/YYYY format"),
+    ]
+    reasons = pd.Series("", index=rows.index)
+    for failed, reason in checks:
+        reasons[failed] += reason + "; "
+    bad = reasons != ""
+
+    valid = pd.DataFrame({
+        "Activity": text['Activity'],
+        "Type": text['Type'],
+        "Duration": duration,
+        "Distance": distance,
+        "Calorie": calorie,
+        "Date": date.dt.strftime(date_format),
+        "Notes": text['Notes'].fillna(""),
+    })[~bad]
+    valid = valid.astype(object).where(valid.notna(), None)
+    valid['Duration'] = valid['Duration'].astype(int)
+    rejects = list(zip(reasons.index[bad], reasons[bad].str.rstrip("; ")))
+    return valid, rejects
+
+#Import activities from CSV or JSON Lines files with a single log write
+def import_activities(paths):
+    batches = []
+    for path in paths:
+        try:
+            rows, rejects = read_import_file(path)
+        except (OSError, ValueError) as e:
+            print(f"Could not read {path}: {e}")
+            continue
+        valid, invalid = validate_import(rows)
+        rejects = sorted(rejects + invalid)
+        batches.append(valid)
+        print(f"{path}: {len(valid)} valid, {len(rejects)} rejected.")
+        for number, reason in rejects:
+            print(f"  row {number}: {reason}")
+
+    new_rows = pd.concat(batches) if batches else pd.DataFrame()
+    if new_rows.empty:
+        print("No activities imported.")
+        return 0
+    record({"op": "import", "rows": new_rows.to_dict("records")})
+    print(f"Imported {len(new_rows)} activities.")
+    return len(new_rows)
+
+#Parse a DD/MM/YYYY command-line date
+def parse_date(text):
+    try:
+        return datetime.strptime(text.strip(), date_format)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid date '{text}', expected DD/MM/YYYY")
+
+#Parse a positive whole number from the command line
+def positive_int(text):
+    try:
+        value = int(text)
+    except ValueError:
+        value = 0
+    if value <= 0:
+        raise argparse.ArgumentTypeError(f"invalid value '{text}', expected a positive integer")
+    return value
+
+#Parse a duration in minutes from the command line
+def duration_minutes(text):
+    value = positive_int(text)
+    if value > max_duration:
+        raise argparse.ArgumentTypeError(f"invalid duration '{text}', expected at most {max_duration} minutes")
+    return value
+
+#Parse a non-negative number from the command line
+def non_negative_float(text):
+    try:
+        value = float(text)
+    except ValueError:
+        value = -1
+    if value < 0:
+        raise argparse.ArgumentTypeError(f"invalid value '{text}', expected a non-negative number")
+    return value
+
+#Arguments shared by the add and edit commands
+def add_activity_arguments(command_parser, required):
+    command_parser.add_argument("--activity", required=required, help="activity name")
+    command_parser.add_argument("--type", required=required, help="activity type")
+    command_parser.add_argument("--duration", type=duration_minutes, required=required, help="duration in minutes")
+    command_parser.add_argument("--distance", type=non_negative_float, help="distance in km")
+    command_parser.add_argument("--calorie", type=non_negative_float, required=required, help="calories burned")
+    command_parser.add_argument("--date", type=parse_date, required=required, help="date (DD/MM/YYYY)")
+    command_parser.add_argument("--notes", help="additional notes")
+
+#Conditions shared by the bulk-edit and bulk-delete commands
+def add_filter_arguments(command_parser):
+    command_parser.add_argument("--from", dest="start", type=parse_date, help="only activities on or after this date (DD/MM/YYYY)")
+    command_parser.add_argument("--to", dest="end", type=parse_date, help="only activities on or before this date (DD/MM/YYYY)")
+    command_parser.add_argument("--where-activity", help="only activities with this name (ignoring case)")
+    command_parser.add_argument("--where-type", help="only activities of this type (ignoring case)")
+    command_parser.add_argument("--keyword", help="only activities containing this keyword")
+    command_parser.add_argument("--where", metavar="QUERY", help="only activities matching a search query, e.g. 'activity:runnings date:2024-11'")
+    command_parser.add_argument("--dry-run", action="store_true", help="only report how many activities match")
+
+#Command-line parser; the same parser reads every line of a batch file
+def build_parser():
+    parser = argparse.ArgumentParser(description="Personal Fitness Journal")
+    parser.add_argument("--profile", metavar="FILE", help="append timings of loads, saves and actions to FILE as JSON lines")
+    parser.add_argument("--profile-dir", metavar="DIR", help="also keep cProfile dumps of the slowest calls in DIR")
+    commands = parser.add_subparsers(dest="command")
+
+    add_parser = commands.add_parser("add", help="add an activity")
+    add_activity_arguments(add_parser, required=True)
+    edit_parser = commands.add_parser("edit", help="change fields of an activity")
+    edit_parser.add_argument("id", type=positive_int, help="ID of the activity as shown by View Details or search")
+    add_activity_arguments(edit_parser, required=False)
+    delete_parser = commands.add_parser("delete", help="delete an activity")
+    delete_parser.add_argument("id", type=positive_int, help="ID of the activity as shown by View Details or search")
+    bulk_edit_parser = commands.add_parser("bulk-edit", help="change fields of every activity matching the conditions, saving once")
+    add_filter_arguments(bulk_edit_parser)
+    add_activity_arguments(bulk_edit_parser, required=False)
+    bulk_delete_parser = commands.add_parser("bulk-delete", help="delete every activity matching the conditions, saving once")
+    add_filter_arguments(bulk_delete_parser)
+    search_parser = commands.add_parser("search", help="search activities by keyword or query")
+    search_parser.add_argument("query", nargs="+", help="keywords, or terms such as activity:cycling type:cardio distance>10 "
+                               "date:2024-11..2024-12 notes:hilly")
+    search_parser.add_argument("--fuzzy", action="store_true", help="rank close matches, tolerating typos")
+
+    summary_parser = commands.add_parser("summary", help="summarize activities between two dates")
+    summary_parser.add_argument("start", type=parse_date, help="start date (DD/MM/YYYY)")
+    summary_parser.add_argument("end", type=parse_date, help="end date (DD/MM/YYYY)")
+    summary_parser.add_argument("--stream", action="store_true", help="read the journal in chunks instead of loading it")
+    summary_parser.add_argument("--journals", metavar="DIR_OR_GLOB", help="summarize every journal in a directory or glob, one per athlete")
+    summary_parser.add_argument("--workers", type=positive_int, help="worker processes for --journals (default: all cores)")
+    summary_parser.add_argument("--by", action="append", choices=sorted(breakdown_columns),
+                                help="break the totals down per activity or per type (repeatable)")
+    commands.add_parser("records", help="show personal records per activity and rolling 7/28-day averages")
+    trend_parser = commands.add_parser("trend", help="totals per day, week or month between two dates")
+    trend_parser.add_argument("start", type=parse_date, help="start date (DD/MM/YYYY)")
+    trend_parser.add_argument("end", type=parse_date, help="end date (DD/MM/YYYY)")
+    trend_parser.add_argument("--every", choices=list(trend_bins), default="week", help="bin size (default: week)")
+    trend_parser.add_argument("--csv", metavar="FILE", help="write the report to FILE as CSV instead of printing it")
+    import_parser = commands.add_parser("import", help="bulk import activities from CSV or JSON Lines files")
+    import_parser.add_argument("files", nargs="+", help="files with Activity, Type, Duration, Distance, Calorie, Date and Notes")
+    batch_parser = commands.add_parser("batch", help="run many commands from a file (or - for stdin), saving once at the end")
+    batch_parser.add_argument("file", nargs="?", default="-", help="file with one command per line")
+
+    convert_parser = commands.add_parser("convert", help="convert a journal file to another storage format")
+    convert_parser.add_argument("source", help="journal to read, e.g. fitness_journal.csv")
+    convert_parser.add_argument("destination", help="file to write, e.g. fitness_journal.parquet")
+    return parser
+
+#Fields given on the command line for edit and bulk-edit, as an operation's changes
+def activity_changes(args):
+    changes = {}
+    for column, value in (("Activity", args.activity), ("Type", args.type), ("Duration", args.duration),
+                          ("Distance", args.distance), ("Calorie", args.calorie), ("Notes", args.notes)):
+        if value is not None:
+            changes[column] = value.strip() if isinstance(value, str) else value
+    if args.date is not None:
+        changes['Date'] = args.date.strftime(date_format)
+    return changes
+
+#Edit or delete every activity matching the command's conditions as one logged operation, then save once
+def bulk_change(args):
+    conditions = (args.start, args.end, args.where_activity, args.where_type, args.keyword, args.where)
+    if all(condition is None for condition in conditions):
+        print("Give at least one condition (--from, --to, --where-activity, --where-type, --keyword or --where).")
+        return False
+    changes = activity_changes(args) if args.command == "bulk-edit" else None
+    if changes == {}:
+        print("Nothing to change.")
+        return False
+    try:
+        labels = [int(label) for label in matching_ids(*conditions)]
+    except ValueError as e:
+        print(f"Invalid query: {e}")
+        return False
+    if args.dry_run or not labels:
+        print(f"{len(labels)} activities match.")
+        return True
+    if changes is None:
+        record({"op": "bulk_delete", "ids": labels})
+        print(f"Deleted {len(labels)} activities.")
+    else:
+        record({"op": "bulk_edit", "ids": labels, "changes": changes})
+        print(f"Updated {len(labels)} activities.")
+    #Batch mode saves once at the end instead
+    if write_ahead:
+        compact_data()
+    return True
+
+#Run one command against the loaded journal; returns False if it failed
+def run_command(args):
+    if args.command == "add":
+        new_entry = {
+            "Activity": args.activity.strip(),
+            "Type": args.type.strip(),
+            "Duration": args.duration,
+            "Distance": args.distance,
+            "Calorie": args.calorie,
+            "Date": args.date.strftime(date_format),
+            "Notes": (args.notes or "").strip(),
+        }
+        if not new_entry["Activity"] or not new_entry["Type"]:
+            print("Activity name and type cannot be empty.")
+            return False
+        record({"op": "add", "row": new_entry})
+        print("New activity added!")
+    elif args.command in ("edit", "delete"):
+        if not has_activity(args.id):
+            print(f"There is no activity with ID {args.id}.")
+            return False
+        if args.command == "delete":
+            record({"op": "delete", "id": args.id})
+            print("Activity deleted successfully!")
+            return True
+        changes = activity_changes(args)
+        if not changes:
+            print("Nothing to change.")
+            return False
+        record({"op": "edit", "id": args.id, "changes": changes})
+        print("Activity updated successfully!")
+    elif args.command in ("bulk-edit", "bulk-delete"):
+        return bulk_change(args)
+    elif args.command == "search":
+        try:
+            results = find_activities(query_from_arguments(args.query).lower(), args.fuzzy)
+        except ValueError as e:
+            print(f"Invalid query: {e}")
+            return False
+        print_results(results)
+    elif args.command == "summary" and args.by:
+        print_breakdown([breakdown_columns[by] for by in args.by], args.start, args.end)
+    elif args.command == "summary":
+        print_summary(summary_totals(args.start, args.end))
+    elif args.command == "records":
+        print_records()
+    elif args.command == "trend":
+        print_trend(args.start, args.end, args.every, args.csv)
+    elif args.command == "import":
+        import_activities(args.files)
+    return True
+
+#Run commands from a file or stdin against one loaded journal, then save once
+def run_batch(parser, path):
+    global write_ahead
+    succeeded = failed = 0
+    write_ahead = False
+    try:
+        source = sys.stdin if path == "-" else open(path)
+        with source:
+            for number, line in enumerate(source, start=1):
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                try:
+                    args = parser.parse_args(shlex.split(line))
+                except (SystemExit, ValueError):
+                    args = None
+                if args is None or args.command not in batch_commands:
+                    print(f"Line {number}: not a valid batch command: {line}")
+                    failed += 1
+                elif instrumented(args.command)(run_command)(args):
+                    succeeded += 1
+                else:
+                    print(f"Line {number}: command failed: {line}")
+                    failed += 1
+    finally:
+        write_ahead = True
+        compact_data()
+    print(f"Batch finished: {succeeded} command(s) run, {failed} failed.")
+
+#Command-line entry point; with no command the interactive menu runs
+def run(argv=None):
+    global profile_log, profile_dir
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    profile_log = args.profile or profile_log
+    profile_dir = args.profile_dir or profile_dir
+    if profile_dir and not profile_log:
+        profile_log = os.path.join(profile_dir, "profile.jsonl")
+
+    if args.command == "convert":
+        convert_journal(args.source, args.destination)
+        return
+    if args.command == "summary" and args.journals and args.by:
+        parser.error("--by cannot be combined with --journals")
+    if args.command == "summary" and args.journals:
+        summarize_journals(args.journals, args.start, args.end, args.workers)
+        return
+    #The log holds edits and deletes that only a full load can apply
+    if args.command == "summary" and args.stream and not args.by and not os.path.exists(log_file):
+        if journal_format(data_file) == "sqlite":
+            print_summary(sqlite_totals(args.start, args.end))
+        else:
+            print_summary(stream_totals(data_file, args.start, args.end))
+        return
+
+    #Initialize the journal and fold any pending or still queued changes into data_file on exit
+    try:
+        load_data()
+    except ValueError as e:
+        print(f"Could not open the journal: {e}")
+        return
+    atexit.register(compact_data)
+    if args.command is None:
+        main()
+    elif args.command == "batch":
+        run_batch(parser, args.file)
+    else:
+        instrumented(args.command)(run_command)(args)
+
 #Run the program
 if __name__ == "__main__":
-    main()
+    run()
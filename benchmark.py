@@ -0,0 +1,271 @@
+import os
+import io
+import sys
+import json
+import time
+import argparse
+import builtins
+import platform
+import tempfile
+import tracemalloc
+import contextlib
+import importlib.util
+import numpy as np
+import pandas as pd
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:
+    #Not available on Windows
+    resource = None
+
+#Benchmark for the fitness journal scripts
+#Generates synthetic journals, drives each operation headlessly and writes a JSON report
+#Example: python benchmark.py --rows 1000 100000 --variant 1.py --output report.json
+
+default_variant = "Personal Fitness Journal - 35419946.py"
+operations = ["add", "edit", "delete", "search", "display_summary"]
+
+#Activity -> (type, mean duration, km per minute, calories per minute)
+activity_profiles = {
+    "running": ("cardio", 45, 0.16, 11.0),
+    "cycling": ("cardio", 75, 0.35, 9.0),
+    "swimming": ("cardio", 40, 0.04, 10.0),
+    "walking": ("cardio", 50, 0.09, 4.5),
+    "yoga": ("flexibility", 50, 0.0, 3.5),
+    "pilates": ("flexibility", 45, 0.0, 4.0),
+    "weights": ("strength", 60, 0.0, 6.0),
+    #Typos like the ones real journals contain
+    "runnings": ("cardio", 45, 0.16, 11.0),
+    "cyclng": ("cardio", 75, 0.35, 9.0),
+}
+activity_weights = [0.3, 0.2, 0.08, 0.12, 0.12, 0.05, 0.1, 0.015, 0.015]
+notes_phrases = [
+    "Morning jog, sunny weather", "Evening ride on a hilly route", "Focused on stretching and mindfulness",
+    "Felt strong today", "Recovery session", "Intervals at the track", "Rainy and windy", "New personal best",
+    "Long slow distance", "", "",
+]
+
+#Write a realistic journal of n rows to path, chunk by chunk so 10M rows fit in memory
+def generate_journal(path, n, seed=0, chunk=1_000_000):
+    rng = np.random.default_rng(seed)
+    names = list(activity_profiles)
+    start = pd.Timestamp(2015, 1, 1)
+    #At least a year and at most ten years of history, always in date order
+    days = min(max(n // 3, 365), 3650)
+    written = 0
+    header = True
+    with open(path, "w", newline="") as f:
+        while written < n:
+            size = min(chunk, n - written)
+            chosen = rng.choice(len(names), size=size, p=activity_weights)
+            profile = [activity_profiles[names[i]] for i in chosen]
+            mean_duration = np.array([p[1] for p in profile])
+            duration = np.maximum(5, rng.normal(mean_duration, mean_duration * 0.25)).astype(int)
+            distance = np.round(duration * np.array([p[2] for p in profile]) * rng.uniform(0.8, 1.2, size), 2)
+            calorie = np.round(duration * np.array([p[3] for p in profile]) * rng.uniform(0.8, 1.2, size))
+            offsets = np.linspace(written, written + size, size, endpoint=False) * days // n
+            dates = start + pd.to_timedelta(offsets.astype(int), unit="D")
+            frame = pd.DataFrame({
+                "Activity": [names[i] for i in chosen],
+                "Type": [p[0] for p in profile],
+                "Duration": duration,
+                "Distance": distance,
+                "Calorie": calorie,
+                "Date": dates.strftime("%d/%m/%Y"),
+                "Notes": rng.choice(notes_phrases, size=size),
+            })
+            frame.to_csv(f, header=header, index=False)
+            header = False
+            written += size
+
+#Answer one prompt the way a user would; works for every variant's wording
+def answer(prompt, query, journal=None):
+    text = prompt.lower()
+    if "page" in text:
+        #Pager prompts: stay on the first page
+        return ""
+    if "keep" in text:
+        #Edit prompts: change the notes, keep everything else
+        return "benchmark edit" if "notes" in text else ""
+    if "index" in text:
+        return "1"
+    if "the id of" in text:
+        #Journals with stable IDs: pick the first activity that has not been deleted
+        deleted = getattr(journal, "tombstones", ())
+        return str(next(label for label in journal.activities.index if label not in deleted))
+    if "keyword" in text:
+        return query
+    if "start date" in text:
+        return "01/01/2016"
+    if "end date" in text:
+        return "31/12/2016"
+    if "yyyy-mm-dd" in text:
+        return "2016-06-15"
+    if "dd/mm/yyyy" in text:
+        return "15/06/2016"
+    if "duration" in text:
+        return "45"
+    if "distance" in text:
+        return "7.5"
+    if "calorie" in text:
+        return "450"
+    if "notes" in text:
+        return "benchmark"
+    if "choice" in text:
+        return "1"
+    raise RuntimeError(f"Unexpected prompt: {prompt!r}")
+
+#Replace input() so operations run without a user; give up if a prompt keeps repeating
+@contextlib.contextmanager
+def scripted_input(query, journal=None, limit=50):
+    asked = []
+    def fake_input(prompt=""):
+        asked.append(prompt)
+        if len(asked) > limit:
+            raise RuntimeError(f"Operation is stuck on prompt {prompt!r}")
+        return answer(prompt, query, journal)
+    original = builtins.input
+    builtins.input = fake_input
+    try:
+        yield
+    finally:
+        builtins.input = original
+
+#Load a variant script as a module (their names have spaces, so import by path)
+def load_variant(path, name):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    with contextlib.redirect_stdout(io.StringIO()):
+        spec.loader.exec_module(module)
+        #Newer versions load in load_data() instead of at import time
+        if hasattr(module, "load_data"):
+            module.load_data()
+    return module
+
+#Latency statistics in milliseconds for a list of timings in seconds
+def describe(timings):
+    ms = np.array(timings) * 1000
+    return {
+        "runs": len(ms),
+        "mean_ms": float(ms.mean()),
+        "min_ms": float(ms.min()),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p90_ms": float(np.percentile(ms, 90)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "max_ms": float(ms.max()),
+        "throughput_per_s": float(len(ms) / ms.sum() * 1000) if ms.sum() else None,
+    }
+
+#Time fn repeat times, then run it once more under tracemalloc for its peak memory
+def measure(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    result = describe(timings)
+    result["peak_memory_mb"] = peak / 2**20
+    return result
+
+#Benchmark one variant on one journal size
+def run_variant(path, rows, repeat, startup_repeat, query, workdir):
+    variant = os.path.basename(path)
+    journal = os.path.join(workdir, "fitness_journal.csv")
+    generate_journal(journal, rows)
+    module_name = f"variant_{abs(hash((variant, rows)))}"
+    results = {}
+
+    previous = os.getcwd()
+    os.chdir(workdir)
+    try:
+        results["startup"] = measure(lambda: load_variant(path, module_name), startup_repeat)
+        module = load_variant(path, module_name)
+        for operation in operations:
+            fn = getattr(module, operation, None)
+            if fn is None:
+                results[operation] = {"skipped": "not defined by this variant"}
+                continue
+            def drive():
+                with scripted_input(query, module), contextlib.redirect_stdout(io.StringIO()):
+                    fn()
+            try:
+                results[operation] = measure(drive, repeat)
+            except Exception as e:
+                results[operation] = {"error": f"{type(e).__name__}: {e}"}
+        #Leave nothing pending behind for the next run
+        if hasattr(module, "compact_data"):
+            module.compact_data()
+    finally:
+        os.chdir(previous)
+    return {"variant": variant, "rows": rows, "operations": results}
+
+#Print a table of p50 latencies, with the ratio to a previous report when given
+def print_report(report, baseline=None):
+    previous = {}
+    if baseline:
+        for result in baseline["results"]:
+            for operation, stats in result["operations"].items():
+                previous[(result["variant"], result["rows"], operation)] = stats.get("p50_ms")
+    print(f"{'variant':40} {'rows':>10} {'operation':>16} {'p50 ms':>10} {'p99 ms':>10} {'peak MB':>9}")
+    for result in report["results"]:
+        for operation, stats in result["operations"].items():
+            if "p50_ms" not in stats:
+                print(f"{result['variant'][:40]:40} {result['rows']:>10} {operation:>16}  {stats.get('error') or stats.get('skipped')}")
+                continue
+            line = (f"{result['variant'][:40]:40} {result['rows']:>10} {operation:>16} "
+                    f"{stats['p50_ms']:>10.2f} {stats['p99_ms']:>10.2f} {stats['peak_memory_mb']:>9.1f}")
+            before = previous.get((result["variant"], result["rows"], operation))
+            if before:
+                line += f"  x{stats['p50_ms'] / before:.2f} vs baseline"
+            print(line)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the fitness journal scripts")
+    parser.add_argument("--rows", type=int, nargs="+", default=[1_000, 10_000, 100_000],
+                        help="journal sizes to generate (up to 10000000)")
+    parser.add_argument("--variant", action="append", help="script to benchmark (repeatable); defaults to the main journal")
+    parser.add_argument("--repeat", type=int, default=20, help="timed runs per operation")
+    parser.add_argument("--startup-repeat", type=int, default=3, help="timed loads of the journal")
+    parser.add_argument("--query", default="hilly", help="keyword used by search")
+    parser.add_argument("--output", default="benchmark_report.json", help="JSON report to write")
+    parser.add_argument("--compare", help="previous JSON report to compare p50 latencies against")
+    args = parser.parse_args(argv)
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    variants = [os.path.abspath(v) for v in (args.variant or [os.path.join(here, default_variant)])]
+    report = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "platform": platform.platform(),
+        "repeat": args.repeat,
+        "results": [],
+    }
+    for path in variants:
+        for rows in args.rows:
+            print(f"Benchmarking {os.path.basename(path)} with {rows} rows...", file=sys.stderr)
+            with tempfile.TemporaryDirectory() as workdir:
+                report["results"].append(run_variant(path, rows, args.repeat, args.startup_repeat, args.query, workdir))
+    #Peak resident memory of the whole run (ru_maxrss is in kilobytes on Linux)
+    if resource is not None:
+        report["max_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    print(f"Report written to {args.output}")
+
+if __name__ == "__main__":
+    main()